@@ -0,0 +1,385 @@
+"""
+シフト最適化ベンチマーク（合成データ）
+
+実際の M_職員 / T_休み希望 / M_設定 CSV を使わずに、規模や条件を変えた合成施設を生成して
+shift_optimizer の性能（モデル構築時間・求解時間・目的値・ギャップ・ピークメモリ）を計測する。
+施設規模が大きくなる前に、グループ数・職員数に対するスケーリングを確認する目的で使う。
+
+使い方（shift_optimizer.py と同じディレクトリで実行）:
+    python shift_benchmark.py --groups 1 2 4 --staff 8 12 16 --time-limit 20
+    python shift_benchmark.py --mode facility --groups 6 --staff 10 --output bench.csv
+    python shift_benchmark.py --write-instance ./synthetic --groups 6 --staff 10
+
+各ケースは別プロセス（spawn）で実行し、そのプロセスの最大常駐メモリ（ru_maxrss）を
+ピークメモリとして記録する。Python・OR-Tools・pandas の読込分も含む値である。
+"""
+
+import argparse
+import calendar
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import shift_optimizer as so
+
+
+# ============================================
+# 合成データ生成
+# ============================================
+
+# 生成パラメータの既定値
+DEFAULT_INSTANCE = {
+    'groups': 6,              # グループ数
+    'staff_per_group': 10,    # 1グループの職員数
+    'care_ratio': 0.15,       # 勤務配慮（夜勤免除）の職員の割合
+    'suction_ratio': 0.25,    # 喀痰吸引資格者の割合
+    'request_density': 0.10,  # 休み希望の密度（職員×日あたりの希望数）
+    'priority_mix': (0.4, 0.3, 0.2, 0.1),  # 優先順位1,2,3,...の出現比率
+    'assign_density': 0.01,   # 事前勤務指定の密度（職員×日あたり）
+    'tail_ratio': 0.3,        # 前月末シフトを持つ職員の割合（夜勤・遅出の引き継ぎ）
+    'year': 2025,
+    'month': 12,              # 月の日数は年月で決まる（28〜31日）
+    'monthly_holidays': 10,
+    'max_consecutive_work': 5,
+    'seed': 1,
+}
+
+# 事前勤務指定に使うシフト（休み・夜勤は前後のルールと衝突しやすいので日中勤務のみ）
+ASSIGN_SHIFT_KEYS = [so.SHIFT_KEY_HAYADE, so.SHIFT_KEY_NIKKIN, so.SHIFT_KEY_OSODE]
+
+# 既定のシフト名（M_設定の SHIFT_xxx_NAME）
+DEFAULT_SHIFT_NAMES = {
+    so.SHIFT_KEY_HAYADE: '早出',
+    so.SHIFT_KEY_NIKKIN: '日勤',
+    so.SHIFT_KEY_OSODE: '遅出',
+    so.SHIFT_KEY_YAKIN: '夜勤',
+    so.SHIFT_KEY_YASUMI: '休み',
+}
+
+
+def _round_trip_csv(df):
+    """CSVとして書き出して読み直す（実データと同じ列型にする）"""
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)))
+
+
+def generate_instance(**params):
+    """
+    合成施設の入力データを生成
+
+    Args:
+        params: DEFAULT_INSTANCE のキー（省略したものは既定値）
+
+    Returns:
+        (holiday_df, staff_df, settings_df) - load_all_input_data() と同じ形式
+    """
+    p = {**DEFAULT_INSTANCE, **params}
+    rnd = random.Random(p['seed'])
+    year, month = p['year'], p['month']
+    year_month = f'{year}{str(month).zfill(2)}'
+    num_days = calendar.monthrange(year, month)[1]
+
+    staff_rows = []
+    holiday_rows = []
+    settings_rows = [
+        (f'MONTHLY_HOLIDAYS_{year_month}', p['monthly_holidays']),
+        ('TARGET_YEAR', year),
+        ('TARGET_MONTH', month),
+        ('DAYS_IN_MONTH', num_days),
+        ('MAX_CONSECUTIVE_WORK_DAYS', p['max_consecutive_work']),
+    ]
+    settings_rows.extend((key + '_NAME', name) for key, name in DEFAULT_SHIFT_NAMES.items())
+
+    priorities = list(range(1, len(p['priority_mix']) + 1))
+
+    for group in range(1, p['groups'] + 1):
+        for i in range(p['staff_per_group']):
+            staff_id = f'bench{group:02d}{i:03d}'
+            staff_rows.append({
+                '職員ID': staff_id,
+                'グループ': group,
+                'ユニット': f'ユニット{group}',
+                '雇用形態': '常勤',
+                '喀痰吸引資格者': 'TRUE' if rnd.random() < p['suction_ratio'] else 'FALSE',
+                '勤務配慮': 'TRUE' if rnd.random() < p['care_ratio'] else 'FALSE',
+                '有効': 'TRUE',
+            })
+
+            # 休み希望（同じ日に複数の希望は出さない）
+            num_requests = min(num_days, round(p['request_density'] * num_days))
+            for day in sorted(rnd.sample(range(1, num_days + 1), num_requests)):
+                holiday_rows.append({
+                    '職員ID': staff_id,
+                    'グループ': group,
+                    '日付': f'{year}-{str(month).zfill(2)}-{str(day).zfill(2)}',
+                    '優先順位': rnd.choices(priorities, weights=p['priority_mix'])[0],
+                    '特記事項': '',
+                })
+
+            # 事前勤務指定
+            for day in range(1, num_days + 1):
+                if rnd.random() < p['assign_density']:
+                    settings_rows.append((
+                        f'ASSIGN_{staff_id}_{year_month}{str(day).zfill(2)}',
+                        rnd.choice(ASSIGN_SHIFT_KEYS)
+                    ))
+
+            # 前月末シフト
+            if rnd.random() < p['tail_ratio']:
+                tail = rnd.choice([
+                    (so.SHIFT_KEY_YASUMI, so.SHIFT_KEY_YAKIN),
+                    (so.SHIFT_KEY_YAKIN, so.SHIFT_KEY_YASUMI),
+                    (so.SHIFT_KEY_NIKKIN, so.SHIFT_KEY_OSODE),
+                ])
+                settings_rows.append((f'PREV_2ND_LAST_SHIFT_{staff_id}', tail[0]))
+                settings_rows.append((f'PREV_LAST_SHIFT_{staff_id}', tail[1]))
+
+    holiday_df = pd.DataFrame(
+        holiday_rows, columns=['職員ID', 'グループ', '日付', '優先順位', '特記事項']
+    )
+    staff_df = pd.DataFrame(staff_rows)
+    settings_df = pd.DataFrame(settings_rows, columns=['設定ID', '設定値'])
+
+    return _round_trip_csv(holiday_df), _round_trip_csv(staff_df), _round_trip_csv(settings_df)
+
+
+def write_instance(directory, **params):
+    """合成データを入力CSVと同じファイル名でディレクトリに書き出す"""
+    p = {**DEFAULT_INSTANCE, **params}
+    year_month = f'{p["year"]}{str(p["month"]).zfill(2)}'
+    holiday_df, staff_df, settings_df = generate_instance(**p)
+
+    os.makedirs(directory, exist_ok=True)
+    for name, df in [('T_休み希望', holiday_df), ('M_職員', staff_df), ('M_設定', settings_df)]:
+        path = os.path.join(directory, f'{name}_{year_month}.csv')
+        df.to_csv(path, index=False)
+        print(f'  {path} ({len(df)}件)')
+
+
+# ============================================
+# 計測
+# ============================================
+
+def _peak_memory_mb():
+    """このプロセスと子プロセスの最大常駐メモリ（MB、Linuxの ru_maxrss はKB単位）"""
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS はバイト単位
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(self_peak, children_peak) / divisor, 1)
+
+
+def _solver_columns(info):
+    """info の探索統計をベンチマーク表の列に変換"""
+    stats = info.get('solver', {})
+    return {
+        'status': info.get('status'),
+        'objective': stats.get('objective'),
+        'best_bound': stats.get('best_bound'),
+        'gap': stats.get('gap'),
+        'conflicts': stats.get('conflicts'),
+    }
+
+
+def bench_groups(case, time_limit, num_workers):
+    """
+    グループ単位のベンチマーク（グループごとに構築・求解し、1グループ1行）
+
+    緩和リトライや解なし診断は行わず、厳格モードの1回の求解だけを計測する。
+    """
+    holiday_df, staff_df, settings_df = generate_instance(**case)
+    settings = so.SettingsIndex(settings_df)
+    shift_name_by_key, SHIFT_TYPES, SHIFT_INFO = so.resolve_shift_names(settings)
+    year, month = case['year'], case['month']
+    num_days = calendar.monthrange(year, month)[1]
+
+    staff = so.StaffTable.from_dataframe(staff_df)
+    all_pre, _ = so.parse_pre_assignments(
+        settings, staff.ids.tolist(), year, month, num_days
+    )
+    all_requests = so.parse_holiday_requests(holiday_df, staff.ids.tolist(), year, month)
+
+    rows = []
+    for group, group_positions in staff.group_positions.items():
+        group_staff = staff.subset(group_positions)
+        staff_ids = group_staff.ids.tolist()
+        group_requests = so.localize_staff_rows(all_requests, group_positions, len(staff))
+        group_pre = so.localize_staff_rows(all_pre, group_positions, len(staff))
+
+        timings = {}
+        with so.measure_phase(timings, 'build'):
+            group_model = so.build_group_model(
+                group, group_staff, group_requests, settings, year, month, group_pre
+            )
+        success, _, info = so.solve_group_model(
+            group_model, shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
+            num_workers=num_workers, time_limit=time_limit
+        )
+
+        rows.append({
+            'group': int(group),
+            'staff': len(staff_ids),
+            'requests': len(group_requests),
+            'assigns': len(group_pre),
+            'variables': info['model_size']['variables'],
+            'constraints': info['model_size']['constraints'],
+            'build_s': timings['build'],
+            'solve_s': info['timings']['solve'],
+            'extract_s': info['timings'].get('extract'),
+            **_solver_columns(info),
+        })
+    return rows
+
+
+def bench_facility(case, time_limit, num_workers):
+    """施設全体のベンチマーク（optimize_shift_with_diagnostics を1回実行し1行）"""
+    holiday_df, staff_df, settings_df = generate_instance(**case)
+    settings = so.SettingsIndex(settings_df)
+    names = so.resolve_shift_names(settings)
+
+    timings = {}
+    schedule, diagnostic = so.optimize_shift_with_diagnostics(
+        holiday_df, staff_df, settings, case['year'], case['month'], *names,
+        core_budget=num_workers, time_limit=time_limit, timings=timings
+    )
+
+    group_results = diagnostic.group_results.values()
+    objectives = [r['details'].get('solver', {}).get('objective') for r in group_results]
+    gaps = [r['details'].get('solver', {}).get('gap') for r in group_results]
+    return [{
+        'groups': case['groups'],
+        'staff': len(staff_df),
+        'requests': len(holiday_df),
+        'succeeded': sum(1 for r in group_results if r.get('success')),
+        'build_s': timings.get('group_build'),
+        'solve_s': timings.get('group_solve'),
+        'groups_wall_s': timings.get('groups'),
+        'verification_s': timings.get('verification'),
+        'objective': sum(o for o in objectives if o is not None),
+        'max_gap': max((g for g in gaps if g is not None), default=None),
+        'records': 0 if schedule is None else len(schedule),
+    }]
+
+
+def run_case(mode, case, time_limit, num_workers):
+    """1ケースを実行して結果行にケース条件とピークメモリを付ける"""
+    start = time.perf_counter()
+    bench = bench_facility if mode == 'facility' else bench_groups
+    rows = bench(case, time_limit, num_workers)
+    peak_mb = _peak_memory_mb()
+    elapsed = round(time.perf_counter() - start, 3)
+    for row in rows:
+        row.update({
+            'case_groups': case['groups'],
+            'case_staff_per_group': case['staff_per_group'],
+            'elapsed_s': elapsed,
+            'peak_mb': peak_mb,
+        })
+    return rows
+
+
+def run_benchmark(cases, mode='groups', time_limit=30.0, num_workers=8, isolate=True):
+    """
+    ケース一覧を順に実行し、結果の表（DataFrame）を返す
+
+    Args:
+        cases: generate_instance の引数dictのリスト
+        mode: 'groups'（グループごとに構築・求解）/ 'facility'（施設全体を1回実行）
+        time_limit: groups ではグループごと、facility では施設全体の制限時間（秒）
+        num_workers: groups ではCP-SATのワーカー数、facility ではCPUコア予算
+        isolate: ケースごとに別プロセスで実行する（ピークメモリをケース単位で測るため）
+    """
+    all_rows = []
+    for i, case in enumerate(cases, 1):
+        print(f'[{i}/{len(cases)}] groups={case["groups"]} staff_per_group={case["staff_per_group"]}'
+              f' request_density={case["request_density"]} seed={case["seed"]}')
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                rows = executor.submit(run_case, mode, case, time_limit, num_workers).result()
+        else:
+            rows = run_case(mode, case, time_limit, num_workers)
+        all_rows.extend(rows)
+
+    return pd.DataFrame(all_rows)
+
+
+# ============================================
+# コマンドライン
+# ============================================
+
+def parse_args(argv=None):
+    d = DEFAULT_INSTANCE
+    parser = argparse.ArgumentParser(description='シフト最適化の合成データベンチマーク')
+    parser.add_argument('--mode', choices=['groups', 'facility'], default='groups')
+    parser.add_argument('--groups', type=int, nargs='+', default=[1])
+    parser.add_argument('--staff', type=int, nargs='+', default=[d['staff_per_group']],
+                        help='1グループの職員数（複数指定でスケーリング計測）')
+    parser.add_argument('--care-ratio', type=float, default=d['care_ratio'])
+    parser.add_argument('--suction-ratio', type=float, default=d['suction_ratio'])
+    parser.add_argument('--request-density', type=float, nargs='+', default=[d['request_density']])
+    parser.add_argument('--priority-mix', type=float, nargs='+', default=list(d['priority_mix']))
+    parser.add_argument('--assign-density', type=float, default=d['assign_density'])
+    parser.add_argument('--tail-ratio', type=float, default=d['tail_ratio'])
+    parser.add_argument('--year', type=int, default=d['year'])
+    parser.add_argument('--month', type=int, default=d['month'])
+    parser.add_argument('--monthly-holidays', type=int, default=d['monthly_holidays'])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[d['seed']])
+    parser.add_argument('--time-limit', type=float, default=30.0)
+    parser.add_argument('--workers', type=int, default=so.MAX_SOLVER_WORKERS_PER_GROUP)
+    parser.add_argument('--in-process', action='store_true',
+                        help='ケースを同じプロセスで実行（ピークメモリはケース単位にならない）')
+    parser.add_argument('--output', help='結果表のCSV出力先')
+    parser.add_argument('--write-instance', metavar='DIR',
+                        help='計測せず、合成データを入力CSVとしてDIRに書き出す')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    cases = []
+    for groups, staff, density, seed in itertools.product(
+            args.groups, args.staff, args.request_density, args.seeds):
+        cases.append({
+            **DEFAULT_INSTANCE,
+            'groups': groups,
+            'staff_per_group': staff,
+            'care_ratio': args.care_ratio,
+            'suction_ratio': args.suction_ratio,
+            'request_density': density,
+            'priority_mix': tuple(args.priority_mix),
+            'assign_density': args.assign_density,
+            'tail_ratio': args.tail_ratio,
+            'year': args.year,
+            'month': args.month,
+            'monthly_holidays': args.monthly_holidays,
+            'seed': seed,
+        })
+
+    if args.write_instance:
+        write_instance(args.write_instance, **cases[0])
+        return None
+
+    table = run_benchmark(cases, mode=args.mode, time_limit=args.time_limit,
+                          num_workers=args.workers, isolate=not args.in_process)
+
+    print('\n' + '=' * 60)
+    print('ベンチマーク結果')
+    print('=' * 60)
+    print(table.to_string(index=False))
+
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f'\n{args.output} に保存しました')
+    return table
+
+
+if __name__ == '__main__':
+    main()
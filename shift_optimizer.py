@@ -33,6 +33,17 @@ TARGET_MONTH = 12   #@param {type:"integer"}
 INPUT_FOLDER_ID = '1yUWaYiWftiAyy-IjoWyMxhkEAYDE8puR'  #@param {type:"string"}
 OUTPUT_FOLDER_ID = '1Gxo0-sE1HjVD7q97LFRwAhPa7hHhvJfd'  #@param {type:"string"}
 
+#@markdown ---
+#@markdown ### 入出力先
+#@markdown drive: Google Drive（Colab） / local: ローカルディレクトリ（バッチサーバー・オフライン実行、Webhookなし）
+STORAGE_BACKEND = 'drive'  #@param ["drive", "local"]
+LOCAL_INPUT_DIR = './input'  #@param {type:"string"}
+LOCAL_OUTPUT_DIR = './output'  #@param {type:"string"}
+#@markdown Driveの入力CSVをローカルにキャッシュし、変更がなければ再ダウンロードしません
+INPUT_CACHE_ENABLED = True  #@param {type:"boolean"}
+INPUT_CACHE_DIR = '~/.cache/shift_optimizer/inputs'  #@param {type:"string"}
+INPUT_CACHE_MAX_MB = 200  #@param {type:"integer"}
+
 #@markdown ---
 #@markdown ### GAS Webhook設定
 GAS_WEBHOOK_URL = ''  #@param {type:"string"}
@@ -42,6 +53,28 @@ WEBHOOK_TOKEN = ''  #@param {type:"string"}
 #@markdown ### 診断モード設定
 ENABLE_PARTIAL_OUTPUT = True  #@param {type:"boolean"}
 RELAXED_MODE = False  #@param {type:"boolean"}
+#@markdown 厳格モードで解なし（INFEASIBLE）になったグループについて、両立しない制約の組を職員ごとに特定します
+DIAGNOSE_INFEASIBILITY = True  #@param {type:"boolean"}
+
+#@markdown ---
+#@markdown ### 並列実行設定
+#@markdown グループごとの最適化をプロセスプールで並列実行します（0 = CPUコア数に合わせて自動）
+PARALLEL_GROUPS = True  #@param {type:"boolean"}
+MAX_PARALLEL_PROCESSES = 0  #@param {type:"integer"}
+#@markdown ソルバーに割り当てるCPUコア数の合計（0 = 利用可能なコア数を自動検出）
+SOLVER_CORE_BUDGET = 0  #@param {type:"integer"}
+#@markdown 施設全体の計算時間の上限（秒）。全グループ・緩和リトライで按分し、期限で打ち切ります
+FACILITY_TIME_LIMIT_SECONDS = 300  #@param {type:"integer"}
+#@markdown グループごとの入力（職員・休み希望・設定・ヒント）とソルバー設定が前回と同じなら、保存済みの結果を使い再計算しません（最適解・解なしが確定した結果のみ保存）
+RESULT_CACHE_ENABLED = True  #@param {type:"boolean"}
+RESULT_CACHE_DIR = '~/.cache/shift_optimizer/results'  #@param {type:"string"}
+RESULT_CACHE_MAX_MB = 100  #@param {type:"integer"}
+
+#@markdown ---
+#@markdown ### ウォームスタート設定
+#@markdown 既存のシフト結果を初期解ヒントとして使います
+#@markdown （last_run: 同じ月の前回結果 / prev_month: 前月結果を曜日を合わせてずらして使用）
+HINT_SOURCE = 'none'  #@param ["none", "last_run", "prev_month"]
 
 # ============================================
 # ライブラリインストール・インポート
@@ -49,19 +82,24 @@ RELAXED_MODE = False  #@param {type:"boolean"}
 
 # !pip install -q ortools pandas
 
+import os
 import re
 import json
+import hashlib
+import pickle
+import multiprocessing
 import pandas as pd
 import numpy as np
 import calendar
 import requests
 import io
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from ortools.sat.python import cp_model
-from google.colab import auth
-from google.auth import default
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+# google.colab / googleapiclient は Drive を使うときだけ読み込む（DriveStorage 参照）
 
 # ============================================
 # 定数定義
@@ -107,6 +145,25 @@ MIN_STAFF_REQUIREMENTS = {
     SHIFT_KEY_YAKIN:  1,
 }
 
+# 職員マスタの「あり」を表す値（勤務配慮・喀痰吸引資格者）
+TRUTHY_VALUES = (True, 'TRUE', '有', 'あり')
+
+# 1グループあたりのCP-SAT探索ワーカー数の上限（これ以上増やしても効果が薄い）
+MAX_SOLVER_WORKERS_PER_GROUP = 8
+
+# 1回の求解に割り当てる最短時間（秒）。残り時間がこれを下回ると求解を開始しない
+MIN_SOLVE_SECONDS = 1.0
+
+# 解なしの原因特定（矛盾する制約の組の抽出・縮小）に使う時間の上限（秒）
+DIAGNOSIS_TIME_LIMIT_SECONDS = 10.0
+
+# 求解結果キャッシュの形式・モデルの版。制約や目的関数を変えたら上げて、古い結果を使わないようにする
+RESULT_CACHE_VERSION = 4
+
+# 求解結果キャッシュに保存するステータス（最適性・解なしが証明された結果のみ）
+# FEASIBLE は時間切れで打ち切った解なので、次回また計算する（時間が長ければ改善できる）
+RESULT_CACHE_STATUSES = ('OPTIMAL', 'INFEASIBLE')
+
 
 # ============================================
 # 診断結果クラス
@@ -122,6 +179,10 @@ class DiagnosticResult:
         self.staff_issues = []
         self.suggestions = []
         self.partial_results = None
+        self.timings = {}  # 処理フェーズ → 経過時間（秒）
+        self.group_aggregates = None  # 事前診断のグループ別集計（group_staff_aggregates の戻り値）
+        self.facility_headcount = {}  # シフト名 → 施設全体の日別人数
+        self.staff_summary = []  # 職員別の休日・公休・夜勤回数（staff_shift_summary の行）
 
     def add_error(self, category, message, details=None):
         self.errors.append({
@@ -144,9 +205,13 @@ class DiagnosticResult:
         return {
             'errors': self.errors,
             'warnings': self.warnings,
-            'group_results': self.group_results,
+            # グループ番号はnumpyの整数のことがあるため、JSONのキーにできる文字列にする
+            'group_results': {str(group): result for group, result in self.group_results.items()},
             'staff_issues': self.staff_issues,
-            'suggestions': self.suggestions
+            'suggestions': self.suggestions,
+            'facility_headcount': self.facility_headcount,
+            'staff_summary': self.staff_summary,
+            'timings': self.timings
         }
 
     def print_report(self):
@@ -190,86 +255,475 @@ class DiagnosticResult:
             for i, suggestion in enumerate(self.suggestions, 1):
                 print(f'  {i}. {suggestion}')
 
+        if self.timings:
+            print('\n[処理時間]')
+            for phase, seconds in self.timings.items():
+                print(f'  {phase}: {seconds:.2f}秒')
+
         print('\n' + '='*60)
 
 
+@contextmanager
+def measure_phase(timings, phase):
+    """with ブロックの経過時間（秒）を timings[phase] に加算"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(timings.get(phase, 0.0) + time.perf_counter() - start, 3)
+
+
 # ============================================
-# Google Drive認証
+# ストレージ（入出力先: Google Drive / ローカルディレクトリ）
 # ============================================
 
+class StorageBackend:
+    """
+    入力CSVの読込と結果ファイルの保存先
+
+    location は 'input'（M_職員・T_休み希望・M_設定）か 'output'（シフト結果・診断レポート）。
+    """
+
+    label = ''
+    supports_webhook = False  # 保存したファイルをGASが取り込めるか（Webhook通知の可否）
+
+    def read_csv(self, file_name, location='input'):
+        """CSVを読み込む（見つからなければ FileNotFoundError）"""
+        raise NotImplementedError
+
+    def read_csvs(self, file_names, location='input'):
+        """複数のCSVを読み込む（{ファイル名: DataFrame}）"""
+        return {file_name: self.read_csv(file_name, location) for file_name in file_names}
+
+    def write_file(self, file_name, data, mimetype, location='output'):
+        """ファイルを保存（同名の既存ファイルは置き換える）し、ファイルIDを返す"""
+        raise NotImplementedError
+
+
+class FileCache:
+    """
+    キー → バイト列のローカルディスクキャッシュ
+
+    合計サイズが max_bytes を超えたら、最後に使ってから長いものから削除する。
+    キーには内容を一意に決める値（ファイルのハッシュや入力の指紋）を使い、
+    内容が変わったら別キーになるようにする（古い内容の上書き・無効化は行わない）。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r'[^0-9A-Za-z_-]', '_', key))
+
+    def get(self, key):
+        """キャッシュ済みの内容（なければNone）"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 最終使用時刻を更新
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        if len(data) > self.max_bytes:
+            return
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
 def authenticate_drive():
     """Google Drive認証"""
+    from google.colab import auth
+    from google.auth import default
+
     auth.authenticate_user()
     creds, _ = default()
     return creds
 
 
-# ============================================
-# CSV読み込み
-# ============================================
+class DriveStorage(StorageBackend):
+    """
+    Google Drive のフォルダを入出力先にする（Colab での通常運用）
+
+    認証とAPIクライアントの構築はインスタンスごとに1回だけ行い、読込・保存で使い回す。
+    フォルダ内のファイル一覧は1回のクエリで取得してキャッシュする（保存すると取り直す）。
+    cache（FileCache）を渡すと、一覧のハッシュが変わっていないファイルはダウンロードしない。
+    """
+
+    label = 'Drive'
+    supports_webhook = True
+
+    def __init__(self, input_folder_id, output_folder_id, cache=None):
+        self.folder_ids = {'input': input_folder_id, 'output': output_folder_id}
+        self.cache = cache
+        self._creds = None
+        self._session = None
+        self._listings = {}  # location → {ファイル名: ファイル情報}
+        self._thread_local = threading.local()
+
+    def _service(self):
+        if self._session is None:
+            from googleapiclient.discovery import build
+
+            self._creds = authenticate_drive()
+            self._session = build('drive', 'v3', credentials=self._creds)
+        return self._session
+
+    def _thread_http(self):
+        """
+        並行ダウンロード用のスレッドごとのHTTP接続
+        httplib2 はスレッドセーフではないため、APIクライアントは共有しても接続は分ける
+        """
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            import httplib2
+            import google_auth_httplib2
+
+            http = google_auth_httplib2.AuthorizedHttp(self._creds, http=httplib2.Http())
+            self._thread_local.http = http
+        return http
+
+    def _folder_files(self, location):
+        """フォルダ内のファイル一覧（1回のクエリで取得し、同名ファイルは先頭を使う）"""
+        if location not in self._listings:
+            service = self._service()
+            query = f"'{self.folder_ids[location]}' in parents and trashed=false"
+            files = {}
+            page_token = None
+            while True:
+                results = service.files().list(
+                    q=query,
+                    fields='nextPageToken, files(id, name, md5Checksum, modifiedTime)',
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute()
+                for file in results.get('files', []):
+                    files.setdefault(file['name'], file)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+            self._listings[location] = files
+        return self._listings[location]
+
+    def _file_info(self, file_name, location):
+        file = self._folder_files(location).get(file_name)
+        if file is None:
+            raise FileNotFoundError(f'{file_name} が見つかりません')
+        return file
+
+    @staticmethod
+    def _cache_key(file):
+        """ファイルIDと内容のハッシュ（md5Checksum、なければ modifiedTime）。どちらもなければNone"""
+        version = file.get('md5Checksum') or file.get('modifiedTime')
+        return f'{file["id"]}_{version}' if version else None
+
+    def _download_csv(self, file, http=None):
+        from googleapiclient.http import MediaIoBaseDownload
+
+        cache_key = self._cache_key(file) if self.cache is not None else None
+        if cache_key is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                print(f'  {file["name"]}: 変更がないためキャッシュを使用')
+                return pd.read_csv(io.BytesIO(data))
+
+        request = self._service().files().get_media(fileId=file['id'])
+        if http is not None:
+            request.http = http
+        fh = io.BytesIO()
+        downloader = MediaIoBaseDownload(fh, request)
+
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+
+        if cache_key is not None:
+            self.cache.put(cache_key, fh.getvalue())
+
+        fh.seek(0)
+        return pd.read_csv(fh)
+
+    def read_csv(self, file_name, location='input'):
+        return self._download_csv(self._file_info(file_name, location))
+
+    def read_csvs(self, file_names, location='input'):
+        """一覧で全ファイルの存在を確認してから、並行してダウンロードする"""
+        files = [self._file_info(file_name, location) for file_name in file_names]
+        with ThreadPoolExecutor(max_workers=max(1, len(files))) as executor:
+            frames = list(executor.map(
+                lambda file: self._download_csv(file, self._thread_http()), files
+            ))
+        return dict(zip(file_names, frames))
+
+    def write_file(self, file_name, data, mimetype, location='output'):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        service = self._service()
+
+        # 既存ファイル削除
+        folder_id = self.folder_ids[location]
+        query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+        results = service.files().list(q=query, fields='files(id)').execute()
+        for file in results.get('files', []):
+            service.files().delete(fileId=file['id']).execute()
+            print(f'  既存ファイル削除: {file_name}')
+
+        file_metadata = {
+            'name': file_name,
+            'parents': [folder_id],
+            'mimeType': mimetype
+        }
+
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=True)
+
+        file = service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id'
+        ).execute()
+
+        # フォルダの内容が変わったので一覧は次回取り直す
+        self._listings.pop(location, None)
+        return file.get('id')
+
 
-def load_csv_from_drive(file_name, folder_id):
-    """DriveからCSVを読み込む"""
-    creds = authenticate_drive()
-    service = build('drive', 'v3', credentials=creds)
+class LocalStorage(StorageBackend):
+    """
+    ローカルディレクトリを入出力先にする（バッチサーバー・オフライン実行用）
+
+    GASの3種CSV出力と同じファイル名（M_職員_YYYYMM.csv など）を input_dir に置く。
+    保存したファイルのIDはそのパス。
+    """
+
+    label = 'ローカル'
+    supports_webhook = False
+
+    def __init__(self, input_dir, output_dir):
+        self.dirs = {'input': input_dir, 'output': output_dir}
 
-    query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
-    results = service.files().list(q=query, fields='files(id, name)').execute()
-    files = results.get('files', [])
+    def _path(self, file_name, location):
+        return os.path.join(self.dirs[location], file_name)
 
-    if not files:
-        raise FileNotFoundError(f'{file_name} が見つかりません')
+    def read_csv(self, file_name, location='input'):
+        path = self._path(file_name, location)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'{file_name} が見つかりません（{self.dirs[location]}）')
+        return pd.read_csv(path)
 
-    file_id = files[0]['id']
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+    def write_file(self, file_name, data, mimetype, location='output'):
+        os.makedirs(self.dirs[location], exist_ok=True)
+        path = self._path(file_name, location)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
 
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
 
-    fh.seek(0)
-    df = pd.read_csv(fh)
+def create_storage(backend=None):
+    """フォーム設定（STORAGE_BACKEND）からストレージを作成"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'local':
+        return LocalStorage(LOCAL_INPUT_DIR, LOCAL_OUTPUT_DIR)
+    if backend == 'drive':
+        cache = None
+        if INPUT_CACHE_ENABLED:
+            cache = FileCache(INPUT_CACHE_DIR, INPUT_CACHE_MAX_MB * 1024 * 1024)
+        return DriveStorage(INPUT_FOLDER_ID, OUTPUT_FOLDER_ID, cache=cache)
+    raise ValueError(f'不明なストレージ: {backend}')
+
+
+# ============================================
+# CSV読み込み
+# ============================================
 
+def load_csv(storage, file_name, location='input'):
+    """ストレージからCSVを読み込む"""
+    df = storage.read_csv(file_name, location)
     print(f'  {file_name} を読み込みました ({len(df)}件)')
     return df
 
 
-def load_all_input_data(year, month):
-    """すべての入力データを読み込む"""
+def load_all_input_data(storage, year, month):
+    """すべての入力データを読み込む（Driveでは3ファイルを並行ダウンロード）"""
     year_month = f'{year}{str(month).zfill(2)}'
+    file_names = [
+        f'T_休み希望_{year_month}.csv',
+        f'M_職員_{year_month}.csv',
+        f'M_設定_{year_month}.csv',
+    ]
 
-    holiday_df = load_csv_from_drive(f'T_休み希望_{year_month}.csv', INPUT_FOLDER_ID)
-    staff_df = load_csv_from_drive(f'M_職員_{year_month}.csv', INPUT_FOLDER_ID)
-    settings_df = load_csv_from_drive(f'M_設定_{year_month}.csv', INPUT_FOLDER_ID)
+    frames = storage.read_csvs(file_names)
+    for file_name in file_names:
+        print(f'  {file_name} を読み込みました ({len(frames[file_name])}件)')
 
+    holiday_df, staff_df, settings_df = (frames[file_name] for file_name in file_names)
     return holiday_df, staff_df, settings_df
 
 
-def get_setting(settings_df, setting_id, default_value=None):
-    """設定値を取得"""
-    row = settings_df[settings_df['設定ID'] == setting_id]
+class SettingsIndex:
+    """
+    M_設定CSVの索引（1回の走査で作成し、事前診断・事前指定の解析・各グループの求解で共有する）
+
+    設定ID → 設定値の辞書に加えて、事前勤務指定（ASSIGN_）、前月末シフト（PREV_*）、
+    シフト名（*_NAME）の行を種類別に分けて持つ。同じ設定IDが複数行ある場合、値は先頭の行を使う。
+    ASSIGN_ の行は重複も含めてCSVの行順のまま残す（重複指定の検出用）。
+    """
+
+    def __init__(self, settings_df):
+        self.values = {}
+        self.assign_rows = []            # (設定ID, 設定値) のリスト
+        self.prev_last_shift = {}        # 職員ID → 前月末日のシフトキー
+        self.prev_2nd_last_shift = {}    # 職員ID → 前月末日-1日のシフトキー
+        self.shift_names = {}            # シフトキー → シフト名
+
+        for setting_id, value in zip(settings_df['設定ID'].astype(str), settings_df['設定値']):
+            if setting_id.startswith('ASSIGN_'):
+                self.assign_rows.append((setting_id, value))
+            if setting_id in self.values:
+                continue
+            self.values[setting_id] = value
+            if setting_id.startswith('PREV_LAST_SHIFT_'):
+                self.prev_last_shift[setting_id[len('PREV_LAST_SHIFT_'):]] = value
+            elif setting_id.startswith('PREV_2ND_LAST_SHIFT_'):
+                self.prev_2nd_last_shift[setting_id[len('PREV_2ND_LAST_SHIFT_'):]] = value
+            elif setting_id.endswith('_NAME'):
+                self.shift_names[setting_id[:-len('_NAME')]] = value
+
+    @classmethod
+    def of(cls, settings):
+        """SettingsIndex はそのまま、M_設定DataFrame は索引を作って返す"""
+        return settings if isinstance(settings, cls) else cls(settings)
+
+    def get(self, setting_id, default_value=None):
+        return self.values.get(setting_id, default_value)
+
+    def get_int(self, setting_id, default_value):
+        return int(self.values.get(setting_id, default_value))
+
+    def monthly_holidays(self, year, month):
+        """対象月の公休数（MONTHLY_HOLIDAYS_YYYYMM、未設定なら9日）"""
+        return self.get_int(f'MONTHLY_HOLIDAYS_{year}{str(month).zfill(2)}', 9)
+
+    def max_consecutive_work(self):
+        """連勤の上限（MAX_CONSECUTIVE_WORK_DAYS、未設定なら5日）"""
+        return self.get_int('MAX_CONSECUTIVE_WORK_DAYS', 5)
+
+    def prev_tail(self, staff_id):
+        """前月末2日間のシフトキー (前月末日-1日, 前月末日)。未設定は休み"""
+        staff_id = str(staff_id)
+        return (str(self.prev_2nd_last_shift.get(staff_id, SHIFT_KEY_YASUMI)),
+                str(self.prev_last_shift.get(staff_id, SHIFT_KEY_YASUMI)))
+
+
+def get_setting(settings, setting_id, default_value=None):
+    """設定値を取得（settings は SettingsIndex または M_設定DataFrame）"""
+    if isinstance(settings, SettingsIndex):
+        return settings.get(setting_id, default_value)
+    row = settings[settings['設定ID'] == setting_id]
     if len(row) > 0:
         return row.iloc[0]['設定値']
     return default_value
 
 
+class StaffTable:
+    """
+    M_職員CSVの正規化済みテーブル（1回の走査で作成し、事前診断・各グループの求解・施設横断の検証で共有する）
+
+    有効な職員だけを残し、職員IDは文字列、勤務配慮・喀痰吸引資格者は bool 配列（TRUTHY_VALUES で判定）にする。
+    グループ → 職員の位置（このテーブル内の行インデックス、CSVの行順）の分割も持つ。
+    """
+
+    def __init__(self, ids, groups, care, suction):
+        self.ids = np.asarray(ids, dtype=object)
+        self.groups = np.asarray(groups)
+        self.care = np.asarray(care, dtype=bool)
+        self.suction = np.asarray(suction, dtype=bool)
+        self.group_positions = {
+            group: np.flatnonzero(self.groups == group) for group in sorted(pd.unique(self.groups))
+        }
+
+    @classmethod
+    def from_dataframe(cls, staff_df):
+        """職員DataFrameから有効な職員のテーブルを作る（勤務配慮・喀痰吸引資格者の列がなければ全員なし）"""
+        active = staff_df[staff_df['有効'].isin([True, 'TRUE'])]
+
+        def flag(column):
+            if column not in active:
+                return np.zeros(len(active), dtype=bool)
+            return active[column].isin(TRUTHY_VALUES).to_numpy()
+
+        return cls(active['職員ID'].astype(str).to_numpy(dtype=object), active['グループ'].to_numpy(),
+                   flag('勤務配慮'), flag('喀痰吸引資格者'))
+
+    @classmethod
+    def of(cls, staff):
+        """StaffTable はそのまま、職員DataFrame はテーブルを作って返す"""
+        return staff if isinstance(staff, cls) else cls.from_dataframe(staff)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, positions):
+        """指定した位置の職員だけのテーブル（並びは positions の順）"""
+        return StaffTable(self.ids[positions], self.groups[positions],
+                          self.care[positions], self.suction[positions])
+
+    def for_group(self, group):
+        """グループの職員だけのテーブル"""
+        return self.subset(self.group_positions[group])
+
+
 # ============================================
 # 動的シフト名解決
 # ============================================
 
-def resolve_shift_names(settings_df):
+def resolve_shift_names(settings):
     """
     M_設定CSVからシフト名を動的取得（キー管理）
     SHIFT_HAYADE_NAME=早出 などの行を読み込んでSHIFT_TYPESを構築
 
+    Args:
+        settings: SettingsIndex（M_設定DataFrameも可）
+
     Returns:
         (shift_name_by_key, SHIFT_TYPES, SHIFT_INFO)
     """
+    settings = SettingsIndex.of(settings)
     shift_name_by_key = {}
     for key in SHIFT_KEY_ORDER:
-        name = get_setting(settings_df, key + '_NAME', None)
+        name = settings.shift_names.get(key)
         shift_name_by_key[key] = str(name) if name is not None else key
 
     SHIFT_TYPES = [shift_name_by_key[k] for k in SHIFT_KEY_ORDER]
@@ -278,59 +732,318 @@ def resolve_shift_names(settings_df):
     return shift_name_by_key, SHIFT_TYPES, SHIFT_INFO
 
 
+# ============================================
+# ウォームスタート（既存シフトの解ヒント）
+# ============================================
+
+def _previous_month(year, month):
+    if month == 1:
+        return year - 1, 12
+    return year, month - 1
+
+
+def load_hint_schedule(storage, year, month, source):
+    """
+    初期解ヒントにするシフト結果を出力フォルダから読み込む
+
+    Args:
+        source: 'last_run'（同じ月の前回結果）/ 'prev_month'（前月結果を曜日合わせでずらす）
+
+    Returns:
+        対象月の日付に揃えたDataFrame（職員ID, 勤務開始日, シフト名）。見つからなければNone
+    """
+    if source == 'last_run':
+        hint_year, hint_month = year, month
+    elif source == 'prev_month':
+        hint_year, hint_month = _previous_month(year, month)
+    else:
+        return None
+
+    file_name = f'シフト結果_{hint_year}{str(hint_month).zfill(2)}.csv'
+    try:
+        hint_df = load_csv(storage, file_name, location='output')
+    except FileNotFoundError:
+        print(f'  * ヒント用の {file_name} が見つからないため、ヒントなしで計算します')
+        return None
+
+    hint_df = hint_df[['職員ID', '勤務開始日', 'シフト名']].copy()
+    hint_df['職員ID'] = hint_df['職員ID'].astype(str)
+
+    if source == 'prev_month':
+        # 対象月の各日に、4週前（前月に収まらなければ5週前）の同じ曜日を対応させる
+        days_in_month = calendar.monthrange(year, month)[1]
+        date_map = {}
+        for day in range(1, days_in_month + 1):
+            date = datetime(year, month, day)
+            for weeks in (4, 5):
+                source_date = date - timedelta(weeks=weeks)
+                if (source_date.year, source_date.month) == (hint_year, hint_month):
+                    date_map.setdefault(source_date.strftime('%Y-%m-%d'), []).append(
+                        date.strftime('%Y-%m-%d')
+                    )
+                    break
+        hint_df['勤務開始日'] = hint_df['勤務開始日'].astype(str).map(date_map)
+        hint_df = hint_df.dropna(subset=['勤務開始日']).explode('勤務開始日')
+
+    print(f'  ヒント: {file_name} から{len(hint_df)}件')
+    return hint_df.reset_index(drop=True)
+
+
+def build_shift_matrix(schedule_df, staff_ids, dates, shift_name_by_key):
+    """
+    既存のシフト結果CSV（load_hint_schedule の戻り値）を職員×日のシフトインデックス行列に変換（該当なしは-1）
+
+    グループの初期解ヒントを作るのに使う。シフト名は現在のシフト名・シフトキーのどちらでも受け付ける。
+    今回の求解結果の行列は ShiftSchedule.matrix_for で取り出す。
+    """
+    shift_index_by_name = {}
+    for t, key in enumerate(SHIFT_KEY_ORDER):
+        shift_index_by_name[key] = t
+        shift_index_by_name[shift_name_by_key[key]] = t
+
+    staff_index = {str(sid): i for i, sid in enumerate(staff_ids)}
+    date_index = {date.strftime('%Y-%m-%d'): d for d, date in enumerate(dates)}
+
+    matrix = np.full((len(staff_ids), len(dates)), -1, dtype=np.int8)
+    s_idx = schedule_df['職員ID'].astype(str).map(staff_index)
+    d_idx = schedule_df['勤務開始日'].astype(str).map(date_index)
+    t_idx = schedule_df['シフト名'].astype(str).map(shift_index_by_name)
+    valid = s_idx.notna() & d_idx.notna() & t_idx.notna()
+    matrix[s_idx[valid].astype(int), d_idx[valid].astype(int)] = t_idx[valid].astype(np.int8)
+    return matrix
+
+
 # ============================================
 # 事前勤務指定の解析
 # ============================================
 
-def parse_pre_assignments(settings_df, staff_ids, year, month, num_days):
+def parse_pre_assignments(settings, staff_ids, year, month, num_days, care_staff_ids=()):
     """
     M_設定CSVから ASSIGN_職員ID_YYYYMMDD 形式の事前勤務指定を解析
 
+    ASSIGN_ の行をまとめて分解し、同じ走査でハード制約と矛盾する指定を検出する
+    （夜勤明けの日への勤務、勤務配慮の職員への夜勤、遅出→翌日早出、同じ日への異なる重複指定）。
+    前月末シフト（PREV_*）との組み合わせも判定する。同じ職員・日の重複指定は先頭の行を使う。
+
+    Args:
+        settings: SettingsIndex（M_設定DataFrameも可）
+        staff_ids: 職員IDのリスト（戻り値の職員インデックスはこの順）
+        care_staff_ids: 勤務配慮（夜勤免除）の職員ID
+
     Returns:
-        list of (staff_idx, day_idx, shift_idx, staff_id, day, shift_key)
+        (pre_assignments, conflicts)
+        pre_assignments: (職員インデックス, 日インデックス, シフトインデックス) の int32 配列（n×3）
+        conflicts: 矛盾する指定のリスト。各要素: {'staff_id', 'issue', 'resolved'}
+            resolved が True のもの（異なる重複指定。先頭の行を使う）はモデルに影響しない。
+            False のものはハード制約と両立せず、所属グループが解なしになる（緩和モードでも解消しない）
     """
+    settings = SettingsIndex.of(settings)
+    staff_ids = [str(sid) for sid in staff_ids]
     staff_id_to_idx = {sid: i for i, sid in enumerate(staff_ids)}
-    pre_assignments = []
+    shift_index_by_key = {key: t for t, key in enumerate(SHIFT_KEY_ORDER)}
+
+    rows = pd.DataFrame(settings.assign_rows, columns=['設定ID', '設定値'], dtype=object)
+    parts = rows['設定ID'].str.extract(r'^ASSIGN_(.+)_(\d{4})(\d{2})(\d{2})$')
+    parts.columns = ['staff_key', 'year', 'month', 'day']
+    rows = pd.concat([rows, parts], axis=1).dropna(subset=['staff_key'])
+    rows = rows.assign(s=rows['staff_key'].map(staff_id_to_idx))
+
+    for staff_key in rows.loc[rows['s'].isna(), 'staff_key']:
+        print(f'  * 事前指定: 職員IDが見つかりません - {staff_key}')
+    rows = rows[rows['s'].notna()
+                & (rows['year'].astype(int) == year) & (rows['month'].astype(int) == month)]
+
+    rows = rows.assign(day=rows['day'].astype(int))
+    out_of_range = (rows['day'] < 1) | (rows['day'] > num_days)
+    for staff_key, day in rows.loc[out_of_range, ['staff_key', 'day']].itertuples(index=False):
+        print(f'  * 事前指定: 日付が範囲外 - {staff_key} {day}日')
+    rows = rows[~out_of_range]
+
+    shift_keys = rows['設定値'].astype(str).str.strip()
+    rows = rows.assign(shift_key=shift_keys, t=shift_keys.map(shift_index_by_key))
+    for shift_key, staff_key, day in rows.loc[rows['t'].isna(), ['shift_key', 'staff_key', 'day']].itertuples(index=False):
+        print(f'  * 事前指定: 不明なシフトキー - {shift_key} ({staff_key} {day}日) - スキップ')
+    rows = rows[rows['t'].notna()]
+
+    pre_assignments = np.column_stack([
+        rows['s'].to_numpy(dtype=np.int32),
+        rows['day'].to_numpy(dtype=np.int32) - 1,
+        rows['t'].to_numpy(dtype=np.int32),
+    ]) if len(rows) else np.empty((0, 3), dtype=np.int32)
+
+    conflicts = []
+
+    # 同じ職員・日への重複指定（同じシフトなら1件にまとめ、異なれば先頭の行を使う）
+    duplicated = rows.duplicated(['s', 'day'], keep=False).to_numpy()
+    if duplicated.any():
+        for (s, day), cell in rows[duplicated].groupby(['s', 'day'], sort=True):
+            keys = cell['shift_key'].tolist()
+            if len(set(keys)) > 1:
+                conflicts.append({
+                    'staff_id': staff_ids[int(s)],
+                    'issue': f'{day}日に異なる事前指定が重複しています（{", ".join(keys)}）。先頭の {keys[0]} を使用します',
+                    'resolved': True
+                })
+        pre_assignments = pre_assignments[~rows.duplicated(['s', 'day'], keep='first').to_numpy()]
+
+    # 職員×(前月末2日 + 当月)のシフト行列。-1 は指定なし
+    fixed = np.full((len(staff_ids), num_days + 2), -1, dtype=np.int8)
+    for s, sid in enumerate(staff_ids):
+        for col, key in enumerate(settings.prev_tail(sid)):
+            fixed[s, col] = shift_index_by_key.get(key, -1)
+    fixed[pre_assignments[:, 0], pre_assignments[:, 1] + 2] = pre_assignments[:, 2]
+
+    def day_label(col):
+        return ('前月末日の前日', '前月末日')[col] if col < 2 else f'{col - 1}日'
+
+    # 夜勤明けルール: 夜勤の翌日・翌々日は休み
+    for gap in (1, 2):
+        night = fixed[:, :-gap] == SHIFT_NIGHT
+        after = fixed[:, gap:]
+        violated = night & (after >= 0) & (after != SHIFT_REST)
+        violated[:, :2 - gap] = False    # 前月末どうしの組は対象外
+        for s, col in zip(*np.nonzero(violated)):
+            conflicts.append({
+                'staff_id': staff_ids[s],
+                'issue': f'{day_label(col)}の夜勤の明け（{day_label(col + gap)}）に '
+                         f'{SHIFT_KEY_ORDER[after[s, col]]} が指定されています（夜勤の翌日・翌々日は休み）',
+                'resolved': False
+            })
+
+    # インターバル: 遅出→翌日早出は禁止
+    violated = (fixed[:, :-1] == SHIFT_LATE) & (fixed[:, 1:] == SHIFT_EARLY)
+    violated[:, 0] = False
+    for s, col in zip(*np.nonzero(violated)):
+        conflicts.append({
+            'staff_id': staff_ids[s],
+            'issue': f'{day_label(col)}の遅出の翌日（{day_label(col + 1)}）に早出が指定されています（遅出→早出は禁止）',
+            'resolved': False
+        })
+
+    # 勤務配慮の職員は夜勤免除
+    care = np.isin(staff_ids, [str(sid) for sid in care_staff_ids])
+    violated = care[:, None] & (fixed[:, 2:] == SHIFT_NIGHT)
+    for s, d in zip(*np.nonzero(violated)):
+        conflicts.append({
+            'staff_id': staff_ids[s],
+            'issue': f'{d + 1}日に夜勤が指定されていますが、勤務配慮（夜勤免除）の職員です',
+            'resolved': False
+        })
+
+    return pre_assignments, conflicts
+
+
+def localize_staff_rows(rows, staff_positions, num_staff):
+    """
+    先頭列が職員インデックスの配列（事前勤務指定・休み希望）から、あるグループの行を取り出し
+    職員インデックスをグループ内に振り直す
+
+    Args:
+        rows: parse_pre_assignments / parse_holiday_requests の戻り値の配列
+        staff_positions: グループの職員の、全職員リスト中の位置（グループ内の並び順）
+        num_staff: 全職員数
+    """
+    local_by_global = np.full(num_staff, -1, dtype=np.int32)
+    local_by_global[np.asarray(staff_positions, dtype=np.int64)] = np.arange(len(staff_positions), dtype=np.int32)
+    local = local_by_global[rows[:, 0]]
+    group_rows = rows[local >= 0].copy()
+    group_rows[:, 0] = local[local >= 0]
+    return group_rows
+
+
+# ============================================
+# 休み希望の取り込み
+# ============================================
+
+def holiday_request_weight(priority):
+    """
+    休み希望の重み（希望日に勤務したときのペナルティ）
+    全優先順位をソフト制約にする（P1=30, P2=27, P3=24, ... 最小1）
+    """
+    return np.maximum(1, 33 - np.asarray(priority) * 3)
 
-    for _, row in settings_df.iterrows():
-        setting_id = str(row['設定ID'])
-        m = re.match(r'ASSIGN_(.+)_(\d{4})(\d{2})(\d{2})$', setting_id)
-        if not m:
-            continue
-        staff_key = m.group(1)
-        year_a = int(m.group(2))
-        month_a = int(m.group(3))
-        day_a = int(m.group(4))
-        shift_key = str(row['設定値']).strip()
-
-        if staff_key not in staff_id_to_idx:
-            print(f'  * 事前指定: 職員IDが見つかりません - {staff_key}')
-            continue
-        if year_a != year or month_a != month:
-            continue
-        if day_a < 1 or day_a > num_days:
-            print(f'  * 事前指定: 日付が範囲外 - {staff_key} {day_a}日')
-            continue
-        if shift_key not in SHIFT_KEY_ORDER:
-            print(f'  * 事前指定: 不明なシフトキー - {shift_key} ({staff_key} {day_a}日) - スキップ')
-            continue
 
-        s = staff_id_to_idx[staff_key]
-        d = day_a - 1
-        t = SHIFT_KEY_ORDER.index(shift_key)
-        pre_assignments.append((s, d, t, staff_ids[s], day_a, shift_key))
+def parse_holiday_requests(holiday_df, staff_ids, year, month):
+    """
+    休み希望CSVを (職員インデックス, 日インデックス, 重み) の配列にまとめて変換
+
+    日付・優先順位は一括で解析し、対象月以外・職員マスタにない職員・日付や優先順位が
+    読めない行は除く。同じ職員・日への重複した希望は最も優先される（優先順位の数字が
+    小さい）1件にまとめる。
 
-    return pre_assignments
+    Args:
+        holiday_df: 休み希望DataFrame（職員IDベース）
+        staff_ids: 職員IDのリスト（戻り値の職員インデックスはこの順）
+        year: 対象年
+        month: 対象月
+
+    Returns:
+        int32 配列（n×3）。職員インデックス・日インデックス順に並ぶ
+    """
+    staff_id_to_idx = {str(sid): i for i, sid in enumerate(staff_ids)}
+    request_rows = pd.DataFrame({
+        's': holiday_df['職員ID'].astype(str).map(staff_id_to_idx),
+        'date': pd.to_datetime(holiday_df['日付'], format='mixed', errors='coerce'),
+        'priority': pd.to_numeric(holiday_df['優先順位'], errors='coerce'),
+    }).dropna()
+    in_month = (request_rows['date'].dt.year == year) & (request_rows['date'].dt.month == month)
+    request_rows = request_rows[in_month]
+    if len(request_rows) == 0:
+        return np.empty((0, 3), dtype=np.int32)
+
+    request_rows = (request_rows.assign(d=request_rows['date'].dt.day - 1)
+                    .sort_values('priority', kind='stable')
+                    .drop_duplicates(['s', 'd'], keep='first')
+                    .sort_values(['s', 'd']))
+    return np.column_stack([
+        request_rows['s'].to_numpy(dtype=np.int32),
+        request_rows['d'].to_numpy(dtype=np.int32),
+        holiday_request_weight(request_rows['priority'].to_numpy(dtype=np.int64)).astype(np.int32),
+    ])
 
 
 # ============================================
 # 事前診断（Pre-flight Check）
 # ============================================
 
-def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_by_key):
+def group_staff_aggregates(staff, scheduled_work_days):
+    """
+    有効な職員のグループ別集計（1回の groupby で作成）
+
+    Args:
+        staff: StaffTable
+        scheduled_work_days: 所定勤務日数
+
+    Returns:
+        グループを索引とするDataFrame
+        列: 人数, 勤務配慮, 夜勤可能者, 喀痰吸引資格者, 供給可能枠
+    """
+    is_care = staff.care
+    # 供給可能枠: 勤務配慮ありは所定勤務日数、それ以外は平均夜勤4回（2日換算）を1枠として数える
+    avg_nights = 4
+    staff = pd.DataFrame({
+        'グループ': staff.groups,
+        '勤務配慮': is_care,
+        '喀痰吸引資格者': staff.suction,
+        '供給可能枠': np.where(is_care, scheduled_work_days, scheduled_work_days - avg_nights),
+    })
+    aggregates = staff.groupby('グループ', sort=True).agg(
+        人数=('勤務配慮', 'size'),
+        勤務配慮=('勤務配慮', 'sum'),
+        喀痰吸引資格者=('喀痰吸引資格者', 'sum'),
+        供給可能枠=('供給可能枠', 'sum'),
+    )
+    aggregates.insert(2, '夜勤可能者', aggregates['人数'] - aggregates['勤務配慮'])
+    return aggregates.astype(int)
+
+
+def preflight_check(holiday_df, staff, settings, year, month, shift_name_by_key):
     """
     最適化実行前の診断チェック
     制約が満たせるかを事前に検証
+
+    staff は StaffTable（職員DataFrameも可）、settings は SettingsIndex（M_設定DataFrameも可）。
+    グループ別の集計は diagnostic.group_aggregates に残し、最適化後の対策提案でも使う。
     """
     print('\n  事前診断を実行中...')
 
@@ -340,19 +1053,20 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
     dates = [datetime(year, month, d) for d in range(1, days_in_month + 1)]
 
     # 有効な職員のみ
-    active_staff = staff_df[staff_df['有効'].isin([True, 'TRUE'])].copy()
+    staff = StaffTable.of(staff)
 
     # 設定値取得
-    year_month_key = f'MONTHLY_HOLIDAYS_{year}{str(month).zfill(2)}'
-    monthly_holidays = int(get_setting(settings_df, year_month_key, 9))
+    settings = SettingsIndex.of(settings)
+    monthly_holidays = settings.monthly_holidays(year, month)
     scheduled_work_days = days_in_month - monthly_holidays
 
     sundays = sum(1 for d in dates if d.weekday() == 6)
-    groups = active_staff['グループ'].unique()
+    aggregates = group_staff_aggregates(staff, scheduled_work_days)
+    diagnostic.group_aggregates = aggregates
 
     print(f'    対象月: {year}年{month}月（{days_in_month}日間、日曜{sundays}日）')
-    print(f'    総職員数: {len(active_staff)}名')
-    print(f'    グループ数: {len(groups)}')
+    print(f'    総職員数: {len(staff)}名')
+    print(f'    グループ数: {len(aggregates)}')
     print(f'    月間公休日数: {monthly_holidays}日')
     print(f'    所定勤務日数: {scheduled_work_days}日（夜勤2日換算）')
 
@@ -362,19 +1076,24 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
     osode_name = shift_name_by_key[SHIFT_KEY_OSODE]
     yakin_name = shift_name_by_key[SHIFT_KEY_YAKIN]
 
-    # グループごとの診断
-    for group in sorted(groups):
-        group_staff = active_staff[active_staff['グループ'] == group]
-        group_size = len(group_staff)
-
-        care_staff = group_staff[
-            group_staff['勤務配慮'].isin([True, 'TRUE', '有', 'あり'])
-        ]
-        night_capable = group_size - len(care_staff)
-
-        suction_staff = group_staff[
-            group_staff['喀痰吸引資格者'].isin([True, 'TRUE', '有', 'あり'])
-        ]
+    # グループに依らない基準値
+    min_daily_staff = (
+        MIN_STAFF_REQUIREMENTS[SHIFT_KEY_HAYADE] +
+        MIN_STAFF_REQUIREMENTS[SHIFT_KEY_NIKKIN] +
+        MIN_STAFF_REQUIREMENTS[SHIFT_KEY_OSODE] +
+        MIN_STAFF_REQUIREMENTS[SHIFT_KEY_YAKIN]
+    )
+    required_night_shifts = days_in_month
+    max_nights_per_person = (days_in_month - monthly_holidays) // 3
+    weekdays = days_in_month - sundays
+    required_slots = weekdays * 5 + sundays * 4
+
+    # グループごとの診断（集計済みの値で判定）
+    for group, row in aggregates.iterrows():
+        group_size = int(row['人数'])
+        night_capable = int(row['夜勤可能者'])
+        suction_count = int(row['喀痰吸引資格者'])
+        total_available_slots = int(row['供給可能枠'])
 
         result = {
             'success': True,
@@ -382,18 +1101,11 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
             'details': {
                 '人数': group_size,
                 '夜勤可能者': night_capable,
-                '喀痰吸引資格者': len(suction_staff)
+                '喀痰吸引資格者': suction_count
             }
         }
 
         # チェック1: 最低人数確認
-        min_daily_staff = (
-            MIN_STAFF_REQUIREMENTS[SHIFT_KEY_HAYADE] +
-            MIN_STAFF_REQUIREMENTS[SHIFT_KEY_NIKKIN] +
-            MIN_STAFF_REQUIREMENTS[SHIFT_KEY_OSODE] +
-            MIN_STAFF_REQUIREMENTS[SHIFT_KEY_YAKIN]
-        )
-
         if group_size < min_daily_staff:
             result['success'] = False
             result['message'] = f'人数不足（{group_size}名 < 最低{min_daily_staff}名）'
@@ -409,9 +1121,6 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
             diagnostic.add_suggestion(f'グループ{group}に{min_daily_staff - group_size}名以上の増員が必要')
 
         # チェック2: 夜勤可能者の確認
-        required_night_shifts = days_in_month
-        max_nights_per_person = (days_in_month - monthly_holidays) // 3
-
         if night_capable == 0:
             result['success'] = False
             result['message'] = '夜勤可能者が0名'
@@ -430,25 +1139,19 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
                 f'グループ{group}の夜勤可能者{night_capable}名では{days_in_month}日分の夜勤をカバーできません',
                 f'最大{night_capable * max_nights_per_person}回 < 必要{required_night_shifts}回'
             )
-            diagnostic.add_suggestion(
-                f'グループ{group}に夜勤可能者を'
-                f'{(required_night_shifts // max_nights_per_person) + 1 - night_capable}名追加してください'
-            )
-
-        # チェック3: 勤務枠の過不足確認
-        weekdays = days_in_month - sundays
-        required_slots = weekdays * 5 + sundays * 4
-
-        total_available_slots = 0
-        for _, staff in group_staff.iterrows():
-            is_care = staff.get('勤務配慮', '') in [True, 'TRUE', '有', 'あり']
-            if is_care:
-                total_available_slots += scheduled_work_days
+            if max_nights_per_person > 0:
+                diagnostic.add_suggestion(
+                    f'グループ{group}に夜勤可能者を'
+                    f'{(required_night_shifts // max_nights_per_person) + 1 - night_capable}名追加してください'
+                )
             else:
-                avg_nights = 4
-                normal_days = scheduled_work_days - (avg_nights * 2)
-                total_available_slots += normal_days + avg_nights
+                # 公休数が多すぎて1人あたりの夜勤上限が0回（人員を増やしても解消しない）
+                diagnostic.add_suggestion(
+                    f'月間公休日数（{monthly_holidays}日）が多すぎて夜勤を割り当てられません。'
+                    f'MONTHLY_HOLIDAYS_{year}{str(month).zfill(2)} を見直してください'
+                )
 
+        # チェック3: 勤務枠の過不足確認
         result['details']['必要勤務枠'] = required_slots
         result['details']['供給可能枠'] = total_available_slots
 
@@ -461,7 +1164,7 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
             )
 
         # チェック4: 喀痰吸引資格者の確認
-        if len(suction_staff) == 0:
+        if suction_count == 0:
             diagnostic.add_warning(
                 '資格者配置',
                 f'グループ{group}には喀痰吸引資格者がいません',
@@ -472,26 +1175,24 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
             result['message'] = 'OK'
         diagnostic.group_results[group] = result
 
-    # 職員別の休み希望チェック（職員IDベース）
-    active_staff_ids = set(active_staff['職員ID'].astype(str).tolist())
-    for _, row in holiday_df.iterrows():
-        row_staff_id = str(row['職員ID'])
-        if row_staff_id not in active_staff_ids:
-            diagnostic.add_warning(
-                '休み希望',
-                f'休み希望を出した職員ID「{row_staff_id}」が有効な職員マスタに存在しません',
-                'この休み希望は無視されます'
-            )
+    # 職員別の休み希望チェック（職員IDベース、有効な職員IDの集合との突き合わせ）
+    holiday_staff_ids = holiday_df['職員ID'].astype(str)
+    unknown_ids = holiday_staff_ids[~holiday_staff_ids.isin(set(staff.ids))]
+    for row_staff_id, count in unknown_ids.value_counts(sort=False).items():
+        diagnostic.add_warning(
+            '休み希望',
+            f'休み希望を出した職員ID「{row_staff_id}」が有効な職員マスタに存在しません',
+            f'この休み希望（{count}件）は無視されます'
+        )
 
     # 休み希望の集中日チェック
     holiday_counts = holiday_df.groupby('日付').size()
-    for date_str, count in holiday_counts.items():
-        if count > len(active_staff) * 0.3:
-            diagnostic.add_warning(
-                '休み希望集中',
-                f'{date_str}に{count}名の休み希望が集中しています',
-                '人員配置が困難になる可能性があります'
-            )
+    for date_str, count in holiday_counts[holiday_counts > len(staff) * 0.3].items():
+        diagnostic.add_warning(
+            '休み希望集中',
+            f'{date_str}に{count}名の休み希望が集中しています',
+            '人員配置が困難になる可能性があります'
+        )
 
     # 総合判定
     has_critical_error = any(
@@ -509,72 +1210,381 @@ def preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_b
     return diagnostic
 
 
+# ============================================
+# 決定変数テンソル・解の取り出し
+# ============================================
+
+def new_shift_tensor(model, num_staff, num_days, num_shifts):
+    """
+    職員×日×シフトのBoolVarを配列で作成
+
+    制約はスライス（例: shifts[:, d, SHIFT_EARLY] = その日の早出全員）で組み立てる。
+
+    Returns:
+        (shifts, shift_index)
+        shifts: BoolVarのobject配列 (num_staff, num_days, num_shifts)
+        shift_index: 各BoolVarのモデル内変数インデックス（int32配列、同じ形状）
+    """
+    shape = (num_staff, num_days, num_shifts)
+    shifts = np.empty(shape, dtype=object)
+    for s, d, t in np.ndindex(shape):
+        shifts[s, d, t] = model.NewBoolVar(f'shift_s{s}_d{d}_t{t}')
+
+    # 連続して作成しているので変数インデックスは先頭からの連番になる
+    first_index = shifts.flat[0].Index() if shifts.size > 0 else 0
+    shift_index = (first_index + np.arange(shifts.size, dtype=np.int32)).reshape(shape)
+    return shifts, shift_index
+
+
+# ============================================
+# シーケンスルール（シフト遷移のオートマトン）
+# ============================================
+
+def sequence_state_from_tail(prev_2nd_last_key, prev_last_key):
+    """
+    前月末2日分のシフトキーから月初の状態を求める
+
+    状態は (夜勤明けで休みが必要な残り日数, 前日が遅出か) のタプル。
+    """
+    if prev_last_key == SHIFT_KEY_YAKIN:
+        rest_due = 2   # 前月末が夜勤 → 1日目・2日目は休み
+    elif prev_2nd_last_key == SHIFT_KEY_YAKIN:
+        rest_due = 1   # 前月末-1日が夜勤 → 1日目は休み
+    else:
+        rest_due = 0
+    return (rest_due, prev_last_key == SHIFT_KEY_OSODE)
+
+
+def next_sequence_state(state, t):
+    """
+    状態 state の翌日にシフト t を入れたときの次状態（ルール違反ならNone）
+
+    遷移ルールを追加する場合はここに判定と状態の更新を追加する。
+    連勤制限のような日数カウントは状態数が膨らみ探索が遅くなるため、
+    オートマトンには含めず窓制約で表す。
+    """
+    rest_due, after_late = state
+
+    # 夜勤明けルール: 夜勤の翌日・翌々日は休み
+    if rest_due > 0 and t != SHIFT_REST:
+        return None
+    # インターバル: 遅出→翌日早出は禁止
+    if after_late and t == SHIFT_EARLY:
+        return None
+
+    rest_due = 2 if t == SHIFT_NIGHT else max(0, rest_due - 1)
+    return (rest_due, t == SHIFT_LATE)
+
+
+def build_sequence_automaton(initial_states):
+    """
+    開始状態群から到達可能な状態を列挙し、AddAutomaton 用の遷移表を作成
+
+    Returns:
+        (state_ids, transitions)
+        state_ids: 状態タプル → 状態番号
+        transitions: (状態番号, シフトインデックス, 次の状態番号) のリスト
+    """
+    state_ids = {}
+    queue = []
+    for state in initial_states:
+        if state not in state_ids:
+            state_ids[state] = len(state_ids)
+            queue.append(state)
+
+    transitions = []
+    while queue:
+        state = queue.pop()
+        for t in range(len(SHIFT_KEY_ORDER)):
+            next_state = next_sequence_state(state, t)
+            if next_state is None:
+                continue
+            if next_state not in state_ids:
+                state_ids[next_state] = len(state_ids)
+                queue.append(next_state)
+            transitions.append((state_ids[state], t, state_ids[next_state]))
+
+    return state_ids, transitions
+
+
+class ShiftLiteralCache:
+    """
+    シフト変数から派生するリテラルのキャッシュ
+
+    「勤務している」「休み希望が叶わない」は休み変数の否定そのものなので、
+    新しいBoolVarや具象化制約を作らず否定リテラルを返す。
+    「公休」のように新しい変数が必要なものは (種類, 職員, 日) ごとに1回だけ作成する。
+    """
+
+    def __init__(self, model, shifts):
+        self.model = model
+        self.shifts = shifts
+        self._cache = {}
+
+    def rest(self, s, d):
+        """休み"""
+        return self.shifts[s, d, SHIFT_REST]
+
+    def working(self, s, d):
+        """勤務（休み以外）= 休みの否定"""
+        key = ('working', s, d)
+        if key not in self._cache:
+            self._cache[key] = self.rest(s, d).Not()
+        return self._cache[key]
+
+    def true_holiday(self, s, d):
+        """
+        公休 = 休み AND 前日が夜勤ではない（d >= 1）
+        夜勤→翌日の休みは夜勤明け（勤務扱い）で公休に含めない
+        """
+        key = ('true_holiday', s, d)
+        if key not in self._cache:
+            rest = self.rest(s, d)
+            prev_night = self.shifts[s, d - 1, SHIFT_NIGHT]
+            is_true_holiday = self.model.NewBoolVar(f'true_holiday_s{s}_d{d}')
+            # is_true_holiday → rest[d]=1
+            self.model.AddImplication(is_true_holiday, rest)
+            # is_true_holiday → night[d-1]=0
+            self.model.AddImplication(is_true_holiday, prev_night.Not())
+            # rest[d]=1 AND night[d-1]=0 → is_true_holiday
+            self.model.AddBoolOr([rest.Not(), prev_night, is_true_holiday])
+            self._cache[key] = is_true_holiday
+        return self._cache[key]
+
+
+def extract_shift_matrix(solver, shift_index):
+    """
+    求解結果を職員×日のシフトインデックス行列（int8）に変換
+
+    解の値ベクトルを1回で取り出し、変数インデックス（new_shift_tensor の shift_index）で
+    職員×日×シフトの形に並べ替える。どのシフトも1になっていないセル（通常は起こらない）は休みとして扱う。
+    """
+    values = np.asarray(solver.response_proto.solution, dtype=np.int8)[shift_index]
+    assigned = values.any(axis=2)
+    return np.where(assigned, values.argmax(axis=2), SHIFT_REST).astype(np.int8)
+
+
+class ShiftSchedule:
+    """
+    シフト結果（コンパクト形式）
+
+    職員×日のシフトインデックス行列（int8）に、行ごとの職員ID・グループと日付・シフト名・時間の
+    情報を添えたもの。検証・集計は行列のまま行い、シフト結果CSV形式（1職員1日1行・10列）の
+    DataFrameは to_dataframe() を呼んだときに初めて作る。
+    """
+
+    def __init__(self, matrix, staff_ids, groups, dates, SHIFT_TYPES, SHIFT_INFO):
+        self.matrix = np.asarray(matrix, dtype=np.int8)
+        self.staff_ids = np.asarray(staff_ids, dtype=object)
+        self.groups = np.asarray(groups)
+        self.dates = list(dates)
+        self.shift_types = list(SHIFT_TYPES)
+        self.shift_info = SHIFT_INFO
+        self._dataframe = None
+
+    @classmethod
+    def for_group(cls, matrix, staff_ids, group, dates, SHIFT_TYPES, SHIFT_INFO):
+        """1グループ分のシフト結果"""
+        return cls(matrix, staff_ids, [group] * len(staff_ids), dates, SHIFT_TYPES, SHIFT_INFO)
+
+    @classmethod
+    def concat(cls, schedules):
+        """グループ別のシフト結果を1つにまとめる（日付・シフト名は先頭の結果のものを使う）"""
+        first = schedules[0]
+        return cls(
+            np.concatenate([schedule.matrix for schedule in schedules]),
+            np.concatenate([schedule.staff_ids for schedule in schedules]),
+            np.concatenate([schedule.groups for schedule in schedules]),
+            first.dates, first.shift_types, first.shift_info
+        )
+
+    def __len__(self):
+        """シフト結果CSVのレコード数（職員数×日数）"""
+        return self.matrix.size
+
+    def __getstate__(self):
+        # 作成済みのDataFrameはpickle（プロセス間の受け渡し・結果キャッシュ）に含めない
+        return {**self.__dict__, '_dataframe': None}
+
+    def matrix_for(self, staff_ids):
+        """指定した職員の並びに合わせた行列（結果のない職員の行は-1）"""
+        row_by_id = {str(sid): i for i, sid in enumerate(self.staff_ids)}
+        rows = np.array([row_by_id.get(str(sid), -1) for sid in staff_ids], dtype=np.int64)
+        matrix = np.full((len(rows), len(self.dates)), -1, dtype=np.int8)
+        found = rows >= 0
+        matrix[found] = self.matrix[rows[found]]
+        return matrix
+
+    def head(self, n):
+        """先頭 n レコードのDataFrame（プレビュー用。必要な職員の分だけ変換する）"""
+        num_rows = -(-n // max(1, len(self.dates)))
+        preview = ShiftSchedule(self.matrix[:num_rows], self.staff_ids[:num_rows], self.groups[:num_rows],
+                                self.dates, self.shift_types, self.shift_info)
+        return preview._build_dataframe().head(n)
+
+    def to_dataframe(self):
+        """シフト結果CSV形式のDataFrame（職員順・日付順。作成後は保持して再利用）"""
+        if self._dataframe is None:
+            self._dataframe = self._build_dataframe()
+        return self._dataframe
+
+    def to_csv_bytes(self):
+        """シフト結果CSVのバイト列（UTF-8）"""
+        dataframe = self._dataframe if self._dataframe is not None else self._build_dataframe()
+        return dataframe.to_csv(index=False).encode('utf-8')
+
+    def _build_dataframe(self):
+        """
+        シフト名・時間・日付文字列はシフト種類・日ごとに1回だけ作り、行列の値で引いて列ごとに組み立てる
+        """
+        num_staff, num_days = self.matrix.shape
+        yakin_name = self.shift_types[SHIFT_NIGHT]
+
+        # シフト種類ごとの値（インデックス = シフトインデックス）
+        shift_infos = [self.shift_info.get(name, {'開始時間': '', '終了時間': ''}) for name in self.shift_types]
+        shift_names = np.array(self.shift_types, dtype=object)
+        start_times = np.array([info['開始時間'] for info in shift_infos], dtype=object)
+        end_times = np.array([info['終了時間'] for info in shift_infos], dtype=object)
+        # 夜勤（終了時間あり）は翌日に終わる
+        overnight = np.array([name == yakin_name and bool(info['終了時間'])
+                              for name, info in zip(self.shift_types, shift_infos)])
+
+        # 日ごとの値
+        start_dates = np.array([date.strftime('%Y-%m-%d') for date in self.dates], dtype=object)
+        next_dates = np.array([(date + timedelta(days=1)).strftime('%Y-%m-%d') for date in self.dates], dtype=object)
+
+        t = self.matrix.ravel()
+        d = np.tile(np.arange(num_days), num_staff)
+
+        return pd.DataFrame({
+            '確定シフトID': '',
+            '職員ID': np.repeat(self.staff_ids, num_days),
+            'グループ': np.repeat(self.groups, num_days),
+            'シフト名': shift_names[t],
+            '勤務開始日': start_dates[d],
+            '開始時間': start_times[t],
+            '勤務終了日': np.where(overnight[t], next_dates[d], start_dates[d]),
+            '終了時間': end_times[t],
+            '登録日時': '',
+            'カレンダーイベントID': ''
+        })
+
+
 # ============================================
 # グループ別最適化（単一グループ）
 # ============================================
 
-def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
-                          year, month, shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
-                          group_pre_assignments, relaxed=False):
+class ConstraintTags:
+    """
+    解なし診断用のタグリテラル
+
+    ハード制約を職員ごとの制約族（事前指定・公休数・前月末の引き継ぎ・勤務間ルール・
+    連勤制限・夜勤免除）に分け、それぞれを1つのリテラルで有効化する。
+    通常の求解ではタグをすべて1に固定するため、前処理で定数として消え探索には影響しない。
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.entries = []  # (literal, 職員ローカルインデックス, 制約族, 詳細)
+
+    def tag(self, s, family, detail=''):
+        """職員 s の制約族に対応するタグリテラルを作成"""
+        literal = self.model.NewBoolVar(f'tag_{len(self.entries)}_s{s}')
+        self.entries.append((literal, s, family, detail))
+        return literal
+
+    def set_enforced(self, enforced, model=None):
+        """タグのドメインを [1,1]（通常求解）/ [0,1]（診断）に切り替え（model は複製したモデルにも使える）"""
+        variables = (model or self.model).Proto().variables
+        for literal, _, _, _ in self.entries:
+            variables[literal.Index()].domain[0] = 1 if enforced else 0
+
+
+class GroupShiftModel:
+    """
+    構築済みの1グループ分のCP-SATモデル
+
+    公休数の厳守は strict_holidays リテラルで有効化する。求解前にこのリテラルの
+    ドメインを固定/解放して切り替えるため、厳格モードが失敗しても同じモデルのまま
+    緩和モードで再求解できる。
+    診断モードで構築したモデルはハード制約がタグリテラル付きになり、解なし時に
+    diagnose_infeasibility() で矛盾する制約の組を取り出せる。
+    """
+
+    def __init__(self, model, shifts, shift_index, strict_holidays, group, staff_ids, dates,
+                 staff_has_care, staff_has_suction, pre_assignment_count, hint, tags=None,
+                 model_size=None):
+        self.model = model
+        self.shifts = shifts
+        self.shift_index = shift_index
+        self.strict_holidays = strict_holidays
+        self.group = group
+        self.staff_ids = staff_ids
+        self.dates = dates
+        self.staff_has_care = staff_has_care
+        self.staff_has_suction = staff_has_suction
+        self.pre_assignment_count = pre_assignment_count
+        self.hint = hint
+        self.tags = tags  # ConstraintTags（診断モードで構築した場合のみ）
+        self.model_size = model_size  # 変数・制約の総数と制約族ごとの内訳
+
+    def set_strict(self, strict):
+        """
+        厳格モード（公休数厳守）の切り替え
+
+        CP-SATの仮定（assumptions）を使うと前処理と近傍探索が大きく制限され
+        解の質が落ちるため、リテラルのドメインを直接 [1,1] / [0,1] に書き換える。
+        """
+        domain = self.model.Proto().variables[self.strict_holidays.Index()].domain
+        domain[0] = 1 if strict else 0
+
+
+def build_group_model(group, group_staff, group_holiday_requests, settings, year, month,
+                      group_pre_assignments, hint=None, diagnose=False):
     """
-    単一グループのシフト最適化
+    単一グループのCP-SATモデルを構築
 
     Args:
         group: グループ番号
-        group_staff: グループの職員DataFrame
-        group_holiday_df: グループの休み希望DataFrame（職員IDベース）
-        settings_df: 設定DataFrame
+        group_staff: グループの職員（StaffTable、職員DataFrameも可）
+        group_holiday_requests: このグループの休み希望
+            (ローカル職員インデックス, 日インデックス, 重み) の n×3 配列（parse_holiday_requests 参照）
+        settings: SettingsIndex（M_設定DataFrameも可）
         year: 対象年
         month: 対象月
-        shift_name_by_key: キー→シフト名のマッピング
-        SHIFT_TYPES: シフト名リスト（インデックス順）
-        SHIFT_INFO: シフト名→時間情報のマッピング
-        group_pre_assignments: このグループの事前勤務指定リスト
-            各要素: (local_staff_idx, day_idx, shift_idx, staff_id, day, shift_key)
-        relaxed: 制約緩和モード
+        group_pre_assignments: このグループの事前勤務指定
+            (ローカル職員インデックス, 日インデックス, シフトインデックス) の n×3 配列
+        hint: 初期解ヒント（職員×日のシフトインデックス行列、-1はヒントなし）またはNone
+        diagnose: 解なし診断用に、ハード制約を職員ごとのタグリテラルで有効化する
 
     Returns:
-        (success, result_df or error_message, diagnostic_info)
+        GroupShiftModel
     """
 
     days_in_month = calendar.monthrange(year, month)[1]
     dates = [datetime(year, month, d) for d in range(1, days_in_month + 1)]
 
-    staff_ids = group_staff['職員ID'].tolist()
+    group_staff = StaffTable.of(group_staff)
+    staff_ids = group_staff.ids.tolist()
     num_staff = len(staff_ids)
     num_days = days_in_month
-    num_shifts = len(SHIFT_TYPES)
-
-    # 職員ID→ローカルインデックスのマッピング
-    staff_id_to_local = {sid: i for i, sid in enumerate(staff_ids)}
+    num_shifts = len(SHIFT_KEY_ORDER)
 
     # 設定値取得
-    year_month_key = f'MONTHLY_HOLIDAYS_{year}{str(month).zfill(2)}'
-    monthly_holidays = int(get_setting(settings_df, year_month_key, 9))
+    settings = SettingsIndex.of(settings)
+    monthly_holidays = settings.monthly_holidays(year, month)
     scheduled_work_days = days_in_month - monthly_holidays
-    max_consecutive_work = int(get_setting(settings_df, 'MAX_CONSECUTIVE_WORK_DAYS', 5))
+    max_consecutive_work = settings.max_consecutive_work()
 
-    # 職員属性を取得
-    staff_has_care = {}
-    staff_has_suction = {}
-
-    for i, staff_id in enumerate(staff_ids):
-        staff_info = group_staff[group_staff['職員ID'] == staff_id].iloc[0]
-
-        care_value = staff_info.get('勤務配慮', '')
-        staff_has_care[i] = care_value in (True, 'TRUE', '有', 'あり')
-
-        suction_value = staff_info.get('喀痰吸引資格者', '')
-        staff_has_suction[i] = suction_value in (True, 'TRUE', '有', 'あり')
+    # 職員属性（ローカル職員インデックス順の bool リスト）
+    staff_has_care = group_staff.care.tolist()
+    staff_has_suction = group_staff.suction.tolist()
 
     # 前月末シフト情報を読み込み（月初の制約判定用）
     prev_last_shift = {}     # staff_index → shift_key (前月末日)
     prev_2nd_last_shift = {} # staff_index → shift_key (前月末日-1日)
     for i, sid in enumerate(staff_ids):
-        prev_last = get_setting(settings_df, f'PREV_LAST_SHIFT_{sid}', 'SHIFT_YASUMI')
-        prev_2nd = get_setting(settings_df, f'PREV_2ND_LAST_SHIFT_{sid}', 'SHIFT_YASUMI')
-        prev_last_shift[i] = str(prev_last)
-        prev_2nd_last_shift[i] = str(prev_2nd)
+        prev_2nd_last_shift[i], prev_last_shift[i] = settings.prev_tail(sid)
 
     # 日曜日判定
     sundays = set()
@@ -587,142 +1597,149 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
     # ============================================
     model = cp_model.CpModel()
 
-    shifts = {}
-    for s in range(num_staff):
-        for d in range(num_days):
-            for t in range(num_shifts):
-                shifts[(s, d, t)] = model.NewBoolVar(f'shift_s{s}_d{d}_t{t}')
+    # 厳格モードの切り替え用リテラル（GroupShiftModel.set_strict で固定/解放する）
+    strict_holidays = model.NewBoolVar('strict_holidays')
+
+    # 決定変数: shifts[s, d, t]（職員×日×シフトのBoolVar配列）
+    shifts, shift_index = new_shift_tensor(model, num_staff, num_days, num_shifts)
+    literals = ShiftLiteralCache(model, shifts)
+    tags = ConstraintTags(model) if diagnose else None
+
+    def enforce_by_tag(constraint, s, family, detail=''):
+        """診断モードでは制約をタグリテラルで条件付きにする"""
+        if tags is not None:
+            constraint.OnlyEnforceIf(tags.tag(s, family, detail))
+        return constraint
+
+    # 制約族ごとのモデルサイズ（直前の区切りから増えた変数・制約の数）
+    family_sizes = {}
+    size_mark = [0, 0]
+
+    def record_family_size(family):
+        proto = model.Proto()
+        num_vars, num_constraints = len(proto.variables), len(proto.constraints)
+        family_sizes[family] = {
+            'variables': num_vars - size_mark[0],
+            'constraints': num_constraints - size_mark[1],
+        }
+        size_mark[:] = [num_vars, num_constraints]
 
     # 基本制約: 各スタッフは各日に1つのシフトのみ
     for s in range(num_staff):
         for d in range(num_days):
-            model.AddExactlyOne(shifts[(s, d, t)] for t in range(num_shifts))
+            model.AddExactlyOne(shifts[s, d, :].tolist())
+    record_family_size('shift_assignment')
 
     # ============================================
     # 制約0: 事前勤務指定（ハード制約）
     # ============================================
-    for s, d, t, staff_id, day, shift_key in group_pre_assignments:
-        model.Add(shifts[(s, d, t)] == 1)
+    for s, d, t in group_pre_assignments:
+        enforce_by_tag(model.Add(shifts[s, d, t] == 1), s, '事前指定', f'{d + 1}日={SHIFT_KEY_ORDER[t]}')
+    record_family_size('pre_assignment')
 
     # ============================================
     # 制約1: 休み希望（全てソフト制約、優先順位で重み付け）
     # ============================================
-    soft_holiday_penalties = []
-
-    for _, row in group_holiday_df.iterrows():
-        row_staff_id = str(row['職員ID'])
-        if row_staff_id not in staff_id_to_local:
-            continue
-
-        s = staff_id_to_local[row_staff_id]
-        request_date = pd.to_datetime(row['日付']).date()
-
-        if request_date.year == year and request_date.month == month:
-            d = request_date.day - 1
-            priority = int(row['優先順位'])
-
-            # 全優先順位をソフト制約に（P1=30, P2=17, P3=14, ...）
-            weight = max(1, 33 - priority * 3)
-            not_rest = model.NewBoolVar(f'not_rest_s{s}_d{d}')
-            model.Add(shifts[(s, d, SHIFT_REST)] == 0).OnlyEnforceIf(not_rest)
-            model.Add(shifts[(s, d, SHIFT_REST)] == 1).OnlyEnforceIf(not_rest.Not())
-            soft_holiday_penalties.append(not_rest * weight)
+    # 希望日に勤務（= 休みでない）ならペナルティ（重みは holiday_request_weight）
+    soft_holiday_penalties = [
+        literals.working(s, d) * weight for s, d, weight in np.asarray(group_holiday_requests).tolist()
+    ]
+    record_family_size('holiday_request')
 
     # ============================================
-    # 制約2: 連勤制限
+    # 制約2: シーケンスルール
+    # 遷移ルール（インターバル・夜勤明けルール）は職員ごとに1つのオートマトンで判定し、
+    # 前月末2日分のシフトは各職員の開始状態として引き継ぐ。
+    # 連勤制限は連続 max_consecutive_work+1 日の窓で勤務日数を制限する。
     # ============================================
-    for s in range(num_staff):
-        for d in range(num_days - max_consecutive_work):
-            work_vars = []
-            for i in range(max_consecutive_work + 1):
-                is_working = model.NewBoolVar(f'working_s{s}_d{d+i}')
-                model.Add(shifts[(s, d + i, SHIFT_REST)] == 0).OnlyEnforceIf(is_working)
-                model.Add(shifts[(s, d + i, SHIFT_REST)] == 1).OnlyEnforceIf(is_working.Not())
-                work_vars.append(is_working)
-            model.Add(sum(work_vars) <= max_consecutive_work)
+    initial_states = [
+        sequence_state_from_tail(prev_2nd_last_shift.get(s), prev_last_shift.get(s))
+        for s in range(num_staff)
+    ]
+    state_ids, transitions = build_sequence_automaton(initial_states)
+    final_states = sorted(state_ids.values())
+    shift_codes = list(range(num_shifts))
+
+    if tags is not None:
+        # 診断時は前月末の引き継ぎを単独で外せるよう、開始状態を先頭の1記号で選ぶ。
+        # 記号 num_shifts + k で START から状態 k へ遷移する（タグなしなら任意の状態から開始可）。
+        start_state = len(state_ids)
+        transitions = transitions + [
+            (start_state, num_shifts + k, k) for k in state_ids.values()
+        ]
 
-    # ============================================
-    # 制約3: 公休数（夜勤明けの休みは公休に含めない）
-    # 夜勤→翌日「休み」は夜勤明け（勤務扱い）、翌々日「休み」が公休
-    # ============================================
     for s in range(num_staff):
-        true_holidays = []
-        for d in range(num_days):
-            if d == 0:
-                # 月初日: 前月末が夜勤なら休みでも公休外（夜勤明け）
-                if prev_last_shift.get(s) == 'SHIFT_YAKIN':
-                    # 前月末が夜勤 → 1日の休みは夜勤明け、公休にカウントしない
-                    # 前月末が夜勤 → 1日の休みは公休外（何も追加しない）
-                    pass
-                else:
-                    true_holidays.append(shifts[(s, d, SHIFT_REST)])
-            else:
-                # 公休 = 休み AND 前日が夜勤ではない
-                is_true_holiday = model.NewBoolVar(f'true_holiday_s{s}_d{d}')
-                # is_true_holiday → rest[d]=1
-                model.AddImplication(is_true_holiday, shifts[(s, d, SHIFT_REST)])
-                # is_true_holiday → night[d-1]=0
-                model.AddImplication(is_true_holiday, shifts[(s, d-1, SHIFT_NIGHT)].Not())
-                # rest[d]=1 AND night[d-1]=0 → is_true_holiday
-                model.AddBoolOr([
-                    shifts[(s, d, SHIFT_REST)].Not(),
-                    shifts[(s, d-1, SHIFT_NIGHT)],
-                    is_true_holiday
-                ])
-                true_holidays.append(is_true_holiday)
-
-        if relaxed:
-            model.Add(sum(true_holidays) >= monthly_holidays - 2)
-            model.Add(sum(true_holidays) <= monthly_holidays + 2)
+        # 各日のシフトインデックス（ExactlyOne なので重み付き和がそのままインデックスになる）
+        daily_shift = [
+            cp_model.LinearExpr.WeightedSum(shifts[s, d, :].tolist(), shift_codes)
+            for d in range(num_days)
+        ]
+        if tags is None:
+            model.AddAutomaton(daily_shift, state_ids[initial_states[s]], final_states, transitions)
         else:
-            model.Add(sum(true_holidays) == monthly_holidays)
-
-    # ============================================
-    # 制約4: インターバル（遅出→翌日早出は禁止）
-    # ============================================
-    for s in range(num_staff):
-        # 前月末が遅出 → 1日目に早出は禁止
-        if prev_last_shift.get(s) == 'SHIFT_OSODE':
-            model.Add(shifts[(s, 0, SHIFT_EARLY)] == 0)
-
-        for d in range(num_days - 1):
-            model.AddImplication(
-                shifts[(s, d, SHIFT_LATE)],
-                shifts[(s, d + 1, SHIFT_EARLY)].Not()
+            start_symbol = model.NewIntVar(num_shifts, num_shifts + len(state_ids) - 1, f'start_s{s}')
+            if initial_states[s] != (0, False):
+                enforce_by_tag(
+                    model.Add(start_symbol == num_shifts + state_ids[initial_states[s]]),
+                    s, '前月末の引き継ぎ',
+                    f'前月末2日={prev_2nd_last_shift[s]},{prev_last_shift[s]}'
+                )
+            enforce_by_tag(
+                model.AddAutomaton([start_symbol] + daily_shift, start_state, final_states, transitions),
+                s, '勤務間ルール', '夜勤明け・遅出→早出'
             )
 
+        # 連勤制限
+        consecutive_tag = (
+            tags.tag(s, '連勤制限', f'{max_consecutive_work}日まで') if tags is not None else None
+        )
+        for d in range(num_days - max_consecutive_work):
+            work_vars = [literals.working(s, d + i) for i in range(max_consecutive_work + 1)]
+            ct = model.Add(cp_model.LinearExpr.Sum(work_vars) <= max_consecutive_work)
+            if consecutive_tag is not None:
+                ct.OnlyEnforceIf(consecutive_tag)
+    record_family_size('sequence')
+
     # ============================================
-    # 制約5: 夜勤明けルール（夜勤→休→休）
+    # 制約3: 公休数（夜勤明けの休みは公休に含めない）
+    # 夜勤→翌日「休み」は夜勤明け（勤務扱い）、翌々日「休み」が公休
     # ============================================
+    rest = shifts[:, :, SHIFT_REST]
+    night = shifts[:, :, SHIFT_NIGHT]
     for s in range(num_staff):
-        # 前月末が夜勤 → 1日目・2日目は休み必須
-        if prev_last_shift.get(s) == 'SHIFT_YAKIN':
-            model.Add(shifts[(s, 0, SHIFT_REST)] == 1)
-            if num_days > 1:
-                model.Add(shifts[(s, 1, SHIFT_REST)] == 1)
-        # 前月末-1日が夜勤 → 1日目は休み必須
-        if prev_2nd_last_shift.get(s) == 'SHIFT_YAKIN':
-            model.Add(shifts[(s, 0, SHIFT_REST)] == 1)
-
-        for d in range(num_days):
-            if d + 1 < num_days:
-                model.AddImplication(
-                    shifts[(s, d, SHIFT_NIGHT)],
-                    shifts[(s, d + 1, SHIFT_REST)]
-                )
-            if d + 2 < num_days:
-                model.AddImplication(
-                    shifts[(s, d, SHIFT_NIGHT)],
-                    shifts[(s, d + 2, SHIFT_REST)]
-                )
+        true_holidays = []
+        # 月初日: 前月末が夜勤なら休みでも公休外（夜勤明け）
+        if prev_last_shift.get(s) != 'SHIFT_YAKIN':
+            true_holidays.append(rest[s, 0])
+
+        # 2日目以降: 公休 = 休み AND 前日が夜勤ではない
+        true_holidays.extend(literals.true_holiday(s, d) for d in range(1, num_days))
+
+        # 緩和範囲（±2）は常に課し、厳守（==）は strict_holidays が1のときだけ有効にする
+        holiday_sum = cp_model.LinearExpr.Sum(true_holidays)
+        holiday_bounds = [
+            model.Add(holiday_sum >= monthly_holidays - 2),
+            model.Add(holiday_sum <= monthly_holidays + 2),
+        ]
+        strict_holiday_count = model.Add(holiday_sum == monthly_holidays)
+        strict_holiday_count.OnlyEnforceIf(strict_holidays)
+        if tags is not None:
+            holiday_tag = tags.tag(s, '公休数', f'{monthly_holidays}日')
+            for ct in holiday_bounds + [strict_holiday_count]:
+                ct.OnlyEnforceIf(holiday_tag)
+    record_family_size('holiday_count')
 
     # ============================================
     # 制約6: 勤務配慮者は夜勤免除
     # ============================================
-    for s in range(num_staff):
-        if staff_has_care[s]:
-            for d in range(num_days):
-                model.Add(shifts[(s, d, SHIFT_NIGHT)] == 0)
+    care_indices = [s for s in range(num_staff) if staff_has_care[s]]
+    for s in care_indices:
+        care_tag = tags.tag(s, '勤務配慮', '夜勤免除') if tags is not None else None
+        for var in night[s, :]:
+            ct = model.Add(var == 0)
+            if care_tag is not None:
+                ct.OnlyEnforceIf(care_tag)
+    record_family_size('care_night')
 
     # ============================================
     # 制約7: グループ別最低人数（ソフト制約）
@@ -738,32 +1755,25 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
     for d in range(num_days):
         # 早出
         early_short = model.NewIntVar(0, min_early, f'early_short_d{d}')
-        model.Add(
-            sum(shifts[(s, d, SHIFT_EARLY)] for s in range(num_staff)) + early_short >= min_early
-        )
+        model.Add(cp_model.LinearExpr.Sum(shifts[:, d, SHIFT_EARLY].tolist()) + early_short >= min_early)
         min_staff_penalties.append(early_short * 50)
 
         # 日勤（日曜は0でも可）
         if d not in sundays:
             day_short = model.NewIntVar(0, min_day, f'day_short_d{d}')
-            model.Add(
-                sum(shifts[(s, d, SHIFT_DAY)] for s in range(num_staff)) + day_short >= min_day
-            )
+            model.Add(cp_model.LinearExpr.Sum(shifts[:, d, SHIFT_DAY].tolist()) + day_short >= min_day)
             min_staff_penalties.append(day_short * 50)
 
         # 遅出
         late_short = model.NewIntVar(0, min_late, f'late_short_d{d}')
-        model.Add(
-            sum(shifts[(s, d, SHIFT_LATE)] for s in range(num_staff)) + late_short >= min_late
-        )
+        model.Add(cp_model.LinearExpr.Sum(shifts[:, d, SHIFT_LATE].tolist()) + late_short >= min_late)
         min_staff_penalties.append(late_short * 50)
 
         # 夜勤
         night_short = model.NewIntVar(0, min_night, f'night_short_d{d}')
-        model.Add(
-            sum(shifts[(s, d, SHIFT_NIGHT)] for s in range(num_staff)) + night_short >= min_night
-        )
+        model.Add(cp_model.LinearExpr.Sum(shifts[:, d, SHIFT_NIGHT].tolist()) + night_short >= min_night)
         min_staff_penalties.append(night_short * 50)
+    record_family_size('min_staff')
 
     # ============================================
     # 制約8: 喀痰吸引資格者配置（ソフト制約・グループ単位のインセンティブ）
@@ -774,16 +1784,12 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
     # ============================================
     suction_penalties = []
     suction_staff_indices = [i for i in range(num_staff) if staff_has_suction[i]]
+    # 資格者×日×勤務シフト（休み以外）
+    suction_work = shifts[suction_staff_indices, :, :SHIFT_REST]
     if len(suction_staff_indices) > 0:
         for d in range(num_days):
             suction_working = model.NewIntVar(0, len(suction_staff_indices), f'suction_working_d{d}')
-            model.Add(
-                suction_working == sum(
-                    shifts[(s, d, t)]
-                    for s in suction_staff_indices
-                    for t in [SHIFT_EARLY, SHIFT_DAY, SHIFT_LATE, SHIFT_NIGHT]
-                )
-            )
+            model.Add(suction_working == cp_model.LinearExpr.Sum(suction_work[:, d, :].ravel().tolist()))
             no_suction = model.NewBoolVar(f'no_suction_d{d}')
             model.Add(suction_working == 0).OnlyEnforceIf(no_suction)
             model.Add(suction_working >= 1).OnlyEnforceIf(no_suction.Not())
@@ -798,16 +1804,12 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
     if len(suction_staff_indices) > 0:
         for d in range(num_days):
             suction_on_night = model.NewIntVar(0, len(suction_staff_indices), f'suction_night_d{d}')
-            model.Add(
-                suction_on_night == sum(
-                    shifts[(s, d, SHIFT_NIGHT)]
-                    for s in suction_staff_indices
-                )
-            )
+            model.Add(suction_on_night == cp_model.LinearExpr.Sum(suction_work[:, d, SHIFT_NIGHT].tolist()))
             no_suction_night = model.NewBoolVar(f'no_suction_night_d{d}')
             model.Add(suction_on_night == 0).OnlyEnforceIf(no_suction_night)
             model.Add(suction_on_night >= 1).OnlyEnforceIf(no_suction_night.Not())
             suction_night_penalties.append(no_suction_night * 80)
+    record_family_size('suction')
 
     # ============================================
     # 目的関数
@@ -827,11 +1829,8 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
     objective_terms.extend(suction_night_penalties)
 
     # 公平性: 夜勤回数の分散を最小化
-    night_counts = []
-    for s in range(num_staff):
-        if not staff_has_care[s]:
-            night_count = sum(shifts[(s, d, SHIFT_NIGHT)] for d in range(num_days))
-            night_counts.append(night_count)
+    night_capable_indices = [s for s in range(num_staff) if not staff_has_care[s]]
+    night_counts = [cp_model.LinearExpr.Sum(night[s, :].tolist()) for s in night_capable_indices]
 
     if night_counts:
         max_nights = model.NewIntVar(0, num_days, 'max_nights')
@@ -843,72 +1842,788 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
         objective_terms.append(night_diff * 10)
 
     if objective_terms:
-        model.Minimize(sum(objective_terms))
+        model.Minimize(cp_model.LinearExpr.Sum(objective_terms))
+    record_family_size('objective')
 
     # ============================================
-    # 求解
+    # ウォームスタート: 既存のシフトを解ヒントとして与える
     # ============================================
+    if hint is not None:
+        for s, d in zip(*np.nonzero(hint >= 0)):
+            for t in range(num_shifts):
+                model.AddHint(shifts[s, d, t], t == hint[s, d])
+
+    # 通常の求解ではタグをすべて有効（1に固定）にしておく
+    if tags is not None:
+        tags.set_enforced(True)
+
+    return GroupShiftModel(
+        model=model,
+        shifts=shifts,
+        shift_index=shift_index,
+        strict_holidays=strict_holidays,
+        group=group,
+        staff_ids=staff_ids,
+        dates=dates,
+        staff_has_care=staff_has_care,
+        staff_has_suction=staff_has_suction,
+        pre_assignment_count=len(group_pre_assignments),
+        hint=hint,
+        tags=tags,
+        model_size={
+            'variables': size_mark[0],
+            'constraints': size_mark[1],
+            'families': family_sizes,
+        },
+    )
+
+
+def solver_statistics(solver, status):
+    """
+    求解1回分の探索統計
+
+    gap は (目的値 - 下界) / max(1, |目的値|)。制限時間で打ち切られた FEASIBLE では
+    gap が残り、最適性を証明できなかったことを示す。
+    """
+    stats = {
+        'wall_time': round(solver.wall_time, 3),
+        'deterministic_time': round(solver.deterministic_time, 3),
+        'conflicts': int(solver.num_conflicts),
+        'branches': int(solver.num_branches),
+    }
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        objective = solver.objective_value
+        best_bound = solver.best_objective_bound
+        stats['objective'] = objective
+        stats['best_bound'] = best_bound
+        stats['gap'] = round(abs(objective - best_bound) / max(1.0, abs(objective)), 4)
+    return stats
+
+
+def format_solver_summary(info):
+    """探索統計の1行要約（ログ出力用）"""
+    stats = info.get('solver', {})
+    summary = f'{info.get("status")} {stats.get("wall_time", 0):.1f}秒'
+    if 'objective' in stats:
+        summary += (f' 目的値{stats["objective"]:.0f} 下界{stats["best_bound"]:.0f}'
+                    f' ギャップ{stats["gap"] * 100:.1f}%')
+    return summary
+
+
+def solve_group_model(group_model, shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
+                      relaxed=False, num_workers=4, time_limit=60.0):
+    """
+    構築済みモデルを求解
+
+    厳格モードでは公休数を厳守、緩和モードでは±2を許容する（同じモデルを切り替えて使う）。
+    モデルに与えたヒントは再求解時もそのまま使われる。
+
+    Returns:
+        (success, ShiftSchedule or error_message, diagnostic_info)
+    """
+    model = group_model.model
+    staff_has_care = group_model.staff_has_care
+    staff_has_suction = group_model.staff_has_suction
+    num_staff = len(group_model.staff_ids)
+
+    group_model.set_strict(not relaxed)
+
     solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = 60.0
-    solver.parameters.num_search_workers = 4
+    solver.parameters.max_time_in_seconds = float(time_limit)
+    solver.parameters.num_search_workers = num_workers
 
-    status = solver.Solve(model)
+    timings = {}
+    with measure_phase(timings, 'solve'):
+        status = solver.Solve(model)
 
     diagnostic_info = {
-        'status': status,
+        'status': solver.StatusName(status),
         'staff_count': num_staff,
         'night_capable': sum(1 for i in range(num_staff) if not staff_has_care[i]),
         'suction_qualified': sum(1 for i in range(num_staff) if staff_has_suction[i]),
         'relaxed': relaxed,
-        'pre_assignments': len(group_pre_assignments)
+        'pre_assignments': group_model.pre_assignment_count,
+        'num_workers': num_workers,
+        'time_limit': round(float(time_limit), 1),
+        'timings': timings,
+        'solver': solver_statistics(solver, status),
+        'model_size': group_model.model_size
     }
 
     if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-        status_name = {
-            cp_model.UNKNOWN: 'UNKNOWN',
-            cp_model.MODEL_INVALID: 'MODEL_INVALID',
-            cp_model.INFEASIBLE: 'INFEASIBLE',
-        }.get(status, str(status))
-        return (False, f'最適化失敗 (status: {status_name})', diagnostic_info)
+        return (False, f'最適化失敗 (status: {diagnostic_info["status"]})', diagnostic_info)
 
     # ============================================
-    # 結果をDataFrameに変換
+    # 結果をシフト行列（ShiftSchedule）として取り出し
     # ============================================
-    results = []
-    for s, staff_id in enumerate(staff_ids):
-        for d in range(num_days):
-            date = dates[d]
+    with measure_phase(timings, 'extract'):
+        shift_matrix = extract_shift_matrix(solver, group_model.shift_index)
+        schedule = ShiftSchedule.for_group(
+            shift_matrix, group_model.staff_ids, group_model.group, group_model.dates,
+            SHIFT_TYPES, SHIFT_INFO
+        )
 
-            assigned_shift = None
-            for t in range(num_shifts):
-                if solver.Value(shifts[(s, d, t)]) == 1:
-                    assigned_shift = SHIFT_TYPES[t]
-                    break
+    # ヒントからの変更量（何セル・何名のシフトが変わったか）
+    hint = group_model.hint
+    if hint is not None:
+        hint_mask = hint >= 0
+        changed = hint_mask & (shift_matrix != hint)
+        diagnostic_info['hint_cells'] = int(hint_mask.sum())
+        diagnostic_info['hint_changed_cells'] = int(changed.sum())
+        diagnostic_info['hint_changed_staff'] = int(changed.any(axis=1).sum())
 
-            if assigned_shift is None:
-                assigned_shift = shift_name_by_key[SHIFT_KEY_YASUMI]
-
-            shift_info = SHIFT_INFO.get(assigned_shift, {'開始時間': '', '終了時間': ''})
-
-            end_date = date
-            if assigned_shift == shift_name_by_key[SHIFT_KEY_YAKIN] and shift_info['終了時間']:
-                end_date = date + timedelta(days=1)
-
-            results.append({
-                '確定シフトID': '',
-                '職員ID': staff_id,
-                'グループ': group,
-                'シフト名': assigned_shift,
-                '勤務開始日': date.strftime('%Y-%m-%d'),
-                '開始時間': shift_info['開始時間'],
-                '勤務終了日': end_date.strftime('%Y-%m-%d'),
-                '終了時間': shift_info['終了時間'],
-                '登録日時': '',
-                'カレンダーイベントID': ''
-            })
+    return (True, schedule, diagnostic_info)
+
+
+def diagnose_infeasibility(group_model, time_limit=DIAGNOSIS_TIME_LIMIT_SECONDS):
+    """
+    厳格モードで解なしになったモデルから、両立しない制約の組を職員ごとに抽出
+
+    タグリテラルを仮定（assumptions）にして短時間だけ求解し、解なしの根拠となった
+    仮定の集合を取り出す。ハード制約は職員ごとに独立している（職員をまたぐ人数制約は
+    ソフト制約）ため、集合を職員ごとに分けて単独でも解なしかを確かめ、1つずつ外しても
+    解なしのままの制約は除いて組を小さくする。特定した職員の制約を外して繰り返す。
+    時間内に確認できなかった職員は報告しない（その場合は complete が False になる）。
+    仮定は探索を大きく制限するため、目的関数を外した複製モデルでだけ使う（元のモデルは
+    そのまま緩和リトライに使える）。解があるかどうかだけを確かめるので、前処理と
+    線形緩和を切って最初の解で打ち切る。
+
+    Returns:
+        (issues, complete)
+        issues: list of dict: staff_id, issue（原因を特定できなかった場合は空リスト）
+        complete: 時間切れなしで、残りの制約に解があることまで確かめられたか
+            （False の場合、issues は一部の職員だけ・縮小しきれていない組の可能性がある）
+    """
+    tags = group_model.tags
+    if tags is None or not tags.entries:
+        return [], False
+
+    model = group_model.model.Clone()
+    model.ClearObjective()
+    model.Proto().variables[group_model.strict_holidays.Index()].domain[0] = 1
+    tags.set_enforced(False, model)
+    deadline = time.time() + time_limit
+    timed_out = False
+
+    def is_infeasible(entries):
+        nonlocal timed_out
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            timed_out = True
+            return None
+        model.ClearAssumptions()
+        model.AddAssumptions([literal for literal, _, _, _ in entries])
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = remaining
+        solver.parameters.num_search_workers = 1
+        solver.parameters.stop_after_first_solution = True
+        solver.parameters.cp_model_presolve = False
+        solver.parameters.linearization_level = 0
+        status = solver.Solve(model)
+        if status == cp_model.INFEASIBLE:
+            return solver
+        if status == cp_model.UNKNOWN:
+            timed_out = True
+            return None
+        return False
+
+    def core_of(solver, entries):
+        indices = set(solver.SufficientAssumptionsForInfeasibility())
+        return [entry for entry in entries if entry[0].Index() in indices]
+
+    conflicts = []
+    active = list(tags.entries)
+    complete = False
+    while True:
+        solver = is_infeasible(active)
+        if not solver:
+            # 残りの制約に解がある（False）なら、解なしの原因はすべて特定できている
+            complete = solver is False and not timed_out
+            break
+        core = core_of(solver, active)
+
+        found_staff = set()
+        for s in sorted({entry[1] for entry in core}):
+            staff_core = [entry for entry in core if entry[1] == s]
+            solver = is_infeasible(staff_core)
+            if not solver:
+                continue
+            staff_core = core_of(solver, staff_core) or staff_core
+            # 縮小: 外しても解なしのままの制約は原因の組から除く
+            for entry in list(staff_core):
+                if not any(other is entry for other in staff_core):
+                    continue
+                trial = [other for other in staff_core if other is not entry]
+                solver = is_infeasible(trial) if trial else None
+                if solver:
+                    staff_core = core_of(solver, trial) or trial
+            conflicts.extend(staff_core)
+            found_staff.add(s)
+
+        if not found_staff:
+            break
+        active = [entry for entry in active if entry[1] not in found_staff]
+
+    # 職員ごとに制約族をまとめて読みやすくする
+    issues = []
+    for s in sorted({entry[1] for entry in conflicts}):
+        details = {}
+        for _, staff, family, detail in conflicts:
+            if staff == s:
+                details.setdefault(family, []).append(detail)
+        parts = [f'{family}（{", ".join(d for d in detail_list if d)}）'
+                 for family, detail_list in details.items()]
+        issues.append({
+            'staff_id': group_model.staff_ids[s],
+            'issue': f'グループ{group_model.group}: ' + ' + '.join(parts) + ' が両立しません'
+        })
+    return issues, complete
+
+
+def optimize_single_group(group, group_staff, group_holiday_requests, settings,
+                          year, month, shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
+                          group_pre_assignments, relaxed=False, num_workers=4,
+                          time_limit=60.0, hint=None, result_cache=None):
+    """
+    単一グループのシフト最適化（モデル構築＋求解）
+
+    result_cache を渡すと、入力とソルバー設定が前回と同じ場合は求解せずに保存済みの結果を返す
+    （diagnostic_info の cached が True になる）。
+
+    Args:
+        group: グループ番号
+        group_staff: グループの職員（StaffTable、職員DataFrameも可）
+        group_holiday_requests: このグループの休み希望（(ローカル職員インデックス, 日インデックス, 重み) の配列）
+        settings: SettingsIndex（M_設定DataFrameも可）
+        year: 対象年
+        month: 対象月
+        shift_name_by_key: キー→シフト名のマッピング
+        SHIFT_TYPES: シフト名リスト（インデックス順）
+        SHIFT_INFO: シフト名→時間情報のマッピング
+        group_pre_assignments: このグループの事前勤務指定
+            (ローカル職員インデックス, 日インデックス, シフトインデックス) の n×3 配列
+        relaxed: 制約緩和モード
+        num_workers: CP-SATの探索ワーカー数（スケジューラが割り当てたコア数）
+        time_limit: 求解の制限時間（秒）。時間切れ時は見つかった最良解を返す
+        hint: 初期解ヒント（職員×日のシフトインデックス行列、-1はヒントなし）またはNone
+        result_cache: 求解結果キャッシュ（ResultCache）またはNone
+
+    Returns:
+        (success, ShiftSchedule or error_message, diagnostic_info)
+    """
+    settings = SettingsIndex.of(settings)
+    group_staff = StaffTable.of(group_staff)
+    fingerprint = None
+    if result_cache is not None:
+        fingerprint = group_input_fingerprint(
+            group, group_staff, group_holiday_requests, settings, year, month,
+            shift_name_by_key, SHIFT_TYPES, SHIFT_INFO, group_pre_assignments, hint,
+            {'relaxed': relaxed, 'num_workers': num_workers, 'time_limit': time_limit}
+        )
+        cached = result_cache.load(fingerprint)
+        if cached is not None:
+            success, result, info = cached
+            return (success, result, {**info, 'cached': True})
+
+    group_model = build_group_model(
+        group, group_staff, group_holiday_requests, settings, year, month,
+        group_pre_assignments, hint
+    )
+    outcome = solve_group_model(
+        group_model, shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
+        relaxed=relaxed, num_workers=num_workers, time_limit=time_limit
+    )
+    if fingerprint is not None and outcome[2]['status'] in RESULT_CACHE_STATUSES:
+        result_cache.store(fingerprint, outcome)
+    return outcome
+
+
+# ============================================
+# 求解結果キャッシュ（グループ入力の指紋 → 保存済みの結果）
+# ============================================
+
+class ResultCache(FileCache):
+    """
+    グループ単位の求解結果のキャッシュ
+
+    キーは group_input_fingerprint の指紋。値はpickleで保存する。
+    """
+
+    def load(self, fingerprint):
+        """保存済みの結果（なければ・読めなければNone）"""
+        data = self.get(fingerprint)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def store(self, fingerprint, value):
+        self.put(fingerprint, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def group_input_fingerprint(group, group_staff, group_holiday_requests, settings, year, month,
+                            shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
+                            group_pre_assignments, hint, solver_settings):
+    """
+    グループのモデル・結果を決める入力を正規化した指紋（SHA-256）
+
+    build_group_model / ShiftSchedule が読む値だけを、行の順序や表記の揺れ
+    （'TRUE' と True、日付の書式など）を除いて並べる。関係のない列や他グループの設定は含めない。
+
+    Args:
+        group_staff: グループの職員（StaffTable、職員DataFrameも可）
+        settings: SettingsIndex（M_設定DataFrameも可）
+        solver_settings: 結果に影響するソルバー設定（緩和モード・制限時間など）のdict
+
+    Returns:
+        str: 16進の指紋
+    """
+    settings = SettingsIndex.of(settings)
+    group_staff = StaffTable.of(group_staff)
+    days_in_month = calendar.monthrange(year, month)[1]
+    staff = [
+        [staff_id, care, suction, *settings.prev_tail(staff_id)]
+        for staff_id, care, suction in zip(
+            group_staff.ids.tolist(), group_staff.care.tolist(), group_staff.suction.tolist()
+        )
+    ]
+
+    normalized = {
+        'version': RESULT_CACHE_VERSION,
+        'group': str(group),
+        'year_month': [year, month, days_in_month],
+        'staff': staff,
+        'holidays': sorted(np.asarray(group_holiday_requests, dtype=np.int64).reshape(-1, 3).tolist()),
+        'pre_assignments': sorted(np.asarray(group_pre_assignments, dtype=np.int64).reshape(-1, 3).tolist()),
+        'monthly_holidays': settings.monthly_holidays(year, month),
+        'max_consecutive_work': settings.max_consecutive_work(),
+        'shift_types': list(SHIFT_TYPES),
+        'shift_names': shift_name_by_key,
+        'shift_info': SHIFT_INFO,
+        'hint': None if hint is None else hashlib.sha256(np.ascontiguousarray(hint).tobytes()).hexdigest(),
+        'solver': solver_settings,
+    }
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def group_task_fingerprint(task, time_limit):
+    """solve_group_task のタスクの指紋（制限時間はグループ別の按分前の施設全体の値を使う）"""
+    return group_input_fingerprint(
+        task['group'], task['group_staff'], task['group_requests'], task['settings'],
+        task['year'], task['month'], task['shift_name_by_key'], task['SHIFT_TYPES'],
+        task['SHIFT_INFO'], task['group_pre'], task['hint'],
+        {
+            'relaxed': task['relaxed'],
+            'retry_relaxed': task['retry_relaxed'],
+            'diagnose': task['diagnose'],
+            'time_limit': time_limit,
+        }
+    )
+
+
+def is_cacheable_outcome(task, outcome):
+    """
+    期限切れ・時間切れの影響を受けていない（次回も同じ結果になる）グループ結果か
+
+    厳格モード・緩和リトライとも、最適性または解なしが証明されている場合だけ True。
+    解なし診断が時間切れで途中までの場合も True（保存するのはステータスと結果だけ。cacheable_outcome 参照）。
+    """
+    if outcome['info']['status'] not in RESULT_CACHE_STATUSES:
+        return False
+    if not outcome['success'] and task['retry_relaxed']:
+        return outcome['retry'] is not None and outcome['retry'][2]['status'] in RESULT_CACHE_STATUSES
+    return True
+
+
+def cacheable_outcome(outcome):
+    """
+    キャッシュに保存する形のグループ結果
+
+    解なし診断の結果は、原因をすべて特定できた（diagnosis_complete）場合だけ保存する。
+    途中までの診断は保存せず、キャッシュから使うときに診断をやり直す（needs_diagnosis 参照）。
+    """
+    if outcome['diagnosis_complete']:
+        return outcome
+    return {**outcome, 'conflicts': []}
+
+
+def needs_diagnosis(task, outcome):
+    """厳格モードで解なしになったグループで、解なし診断が必要（未完了）か"""
+    return (task['diagnose'] and not outcome['success']
+            and outcome['info']['status'] == 'INFEASIBLE' and not outcome['diagnosis_complete'])
+
+
+def diagnose_group_task(task, time_limit):
+    """
+    保存済みの結果が解なしで診断が途中までだったグループについて、解なし診断だけをやり直す
+
+    Returns:
+        dict: conflicts, diagnosis_complete（solve_group_task の戻り値の同名のキー）
+    """
+    group_model = build_group_model(
+        task['group'], task['group_staff'], task['group_requests'], task['settings'],
+        task['year'], task['month'], task['group_pre'], task['hint'],
+        diagnose=True
+    )
+    conflicts, complete = diagnose_infeasibility(group_model, time_limit)
+    return {'conflicts': conflicts, 'diagnosis_complete': complete}
+
+
+# ============================================
+# グループ単位の実行（逐次 / プロセスプール並列）
+# ============================================
+
+def solve_group_task(task):
+    """
+    1グループ分の最適化を実行（失敗時は必要に応じて緩和モードで再試行）
+
+    モデルは1回だけ構築し、緩和リトライは同じモデルを緩和モードに切り替えて再求解する。
+    プロセスプールのワーカーからも呼ばれるため、引数・戻り値はpickle可能な値のみとする。
+    出力（print）は親プロセス側でまとめて行う。
+    緩和リトライは割り当て時間と同じ長さを上限に、施設全体の期限までの残り時間で実行する。
+
+    Args:
+        task: optimize_single_group の引数一式と retry_relaxed, diagnose, num_workers,
+              time_limit（割り当て時間）, deadline（施設全体の期限、time.time()基準）を持つdict
+
+    Returns:
+        dict: group, success, result, info, retry（緩和リトライ結果 or None）,
+              conflicts（解なし診断で特定した職員別の矛盾、diagnose_infeasibility の戻り値）,
+              diagnosis_complete（診断が不要、または原因をすべて特定できたか）
+    """
+    build_timings = {}
+    with measure_phase(build_timings, 'build'):
+        group_model = build_group_model(
+            task['group'], task['group_staff'], task['group_requests'], task['settings'],
+            task['year'], task['month'], task['group_pre'], task['hint'],
+            diagnose=task['diagnose']
+        )
+    success, result, info = solve_group_model(
+        group_model, task['shift_name_by_key'], task['SHIFT_TYPES'], task['SHIFT_INFO'],
+        relaxed=task['relaxed'], num_workers=task['num_workers'], time_limit=task['time_limit']
+    )
+    info['timings'] = {**build_timings, **info['timings']}
+
+    # 厳格モードで解なしと証明された場合は、緩和リトライの前に矛盾する制約の組を特定
+    conflicts = []
+    diagnosis_complete = True
+    if not success and task['diagnose'] and info['status'] == 'INFEASIBLE':
+        diagnosis_complete = False
+        diagnosis_time_limit = min(DIAGNOSIS_TIME_LIMIT_SECONDS, task['deadline'] - time.time())
+        if diagnosis_time_limit >= MIN_SOLVE_SECONDS:
+            with measure_phase(info['timings'], 'diagnose'):
+                conflicts, diagnosis_complete = diagnose_infeasibility(group_model, diagnosis_time_limit)
+
+    retry = None
+    retry_time_limit = min(task['time_limit'], task['deadline'] - time.time())
+    if not success and task['retry_relaxed'] and retry_time_limit >= MIN_SOLVE_SECONDS:
+        retry = solve_group_model(
+            group_model, task['shift_name_by_key'], task['SHIFT_TYPES'], task['SHIFT_INFO'],
+            relaxed=True, num_workers=task['num_workers'], time_limit=retry_time_limit
+        )
+
+    return {
+        'group': task['group'],
+        'success': success,
+        'result': result,
+        'info': info,
+        'retry': retry,
+        'conflicts': conflicts,
+        'diagnosis_complete': diagnosis_complete,
+    }
+
+
+def _process_pool_context():
+    """
+    プロセスプールの開始方式を決定
+    Colabのセル内で定義された関数はspawnでは子プロセスから参照できないため、forkを優先する
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def detect_available_cores():
+    """このプロセスが利用可能なCPUコア数を取得（CPUアフィニティを考慮）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def estimate_group_difficulty(task):
+    """
+    グループの難しさの目安（コア配分の重み）
+
+    職員数を基本に、休み希望の密度（職員×日あたりの希望数）と事前勤務指定数で補正する。
+    """
+    num_staff = len(task['group_staff'])
+    num_days = calendar.monthrange(task['year'], task['month'])[1]
+    request_density = len(task['group_requests']) / max(1, num_staff * num_days)
+    return num_staff * (1.0 + request_density) + 0.5 * len(task['group_pre'])
+
+
+class GroupSolveScheduler:
+    """
+    CPUコア予算と施設全体の計算時間をグループ間で配分するスケジューラ
+
+    待機中のグループは重い順に開始する。開始時点の空きコアを、待機中グループの
+    重みに応じて按分して探索ワーカー数を決める。他の待機グループの開始分は1コアずつ残す。
+    実行中のCP-SATのワーカー数は変更できないため、早く終わったグループが返したコアは
+    次に開始するグループへ割り当てられる（後に開始するグループほど多くのコアを得る）。
+
+    制限時間も開始時点の残り時間から按分する。残りのグループが同時実行数で何巡するかで
+    残り時間を割り、重みで補正する。早く最適解に到達したグループが使わなかった時間は、
+    後から開始するグループと緩和リトライに回る。
+    """
+
+    def __init__(self, total_cores, max_workers_per_group=MAX_SOLVER_WORKERS_PER_GROUP,
+                 deadline=None, concurrency=1):
+        self.total_cores = max(1, total_cores)
+        self.free_cores = self.total_cores
+        self.max_workers_per_group = max(1, max_workers_per_group)
+        self.deadline = deadline
+        self.concurrency = max(1, concurrency)
+        self.pending = []  # (weight, key)
+
+    def add(self, key, weight):
+        self.pending.append((weight, key))
+        self.pending.sort(key=lambda item: -item[0])
+
+    def has_pending(self):
+        return len(self.pending) > 0
+
+    def remaining_seconds(self):
+        """施設全体の期限までの残り時間（期限なしはNone）"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def next_dispatch(self):
+        """
+        次に開始するグループと割り当てワーカー数・制限時間を返す
+
+        Returns:
+            (key, num_workers, time_limit) or None（待機なし・空きコアなし）
+            time_limit が MIN_SOLVE_SECONDS 未満なら期限切れ（求解しない）
+        """
+        if not self.pending or self.free_cores < 1:
+            return None
+
+        weight, key = self.pending.pop(0)
+        total_weight = weight + sum(w for w, _ in self.pending)
+        time_limit = self._time_slice(weight, total_weight)
+        reserve = min(len(self.pending), self.free_cores - 1)
+
+        share = int(self.free_cores * weight / total_weight) if total_weight > 0 else 1
+        workers = max(1, min(share, self.free_cores - reserve, self.max_workers_per_group))
+        # 最後の待機グループは空きコアをすべて使う
+        if not self.pending:
+            workers = max(1, min(self.free_cores, self.max_workers_per_group))
+
+        self.free_cores -= workers
+        return key, workers, time_limit
+
+    def _time_slice(self, weight, total_weight):
+        """開始するグループの制限時間（残り時間を残り巡回数で割り、重みで補正）"""
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return 60.0
+
+        num_groups = len(self.pending) + 1
+        rounds = -(-num_groups // self.concurrency)  # 切り上げ
+        average_weight = total_weight / num_groups
+        scale = weight / average_weight if average_weight > 0 else 1.0
+        return min(remaining, remaining / rounds * scale)
+
+    def release(self, num_workers):
+        """終了したグループのコアを返却"""
+        self.free_cores = min(self.total_cores, self.free_cores + num_workers)
+
+
+def _deadline_outcome(task):
+    """期限切れで求解を開始できなかったグループの結果"""
+    return {
+        'group': task['group'],
+        'success': False,
+        'result': '施設全体の制限時間に達したため未計算',
+        'info': {
+            'status': 'NOT_STARTED',
+            'staff_count': len(task['group_staff']),
+            'deadline_exceeded': True,
+        },
+        'retry': None,
+        'conflicts': [],
+        'diagnosis_complete': True,
+    }
+
+
+def run_group_tasks(tasks, parallel=True, max_processes=0, core_budget=0, time_limit=None):
+    """
+    グループ別タスクを実行し、結果をグループ順に返す
+
+    Args:
+        tasks: solve_group_task に渡すタスクのリスト（num_workers, time_limit, deadline は実行時に設定）
+        parallel: プロセスプールで並列実行するか（同時実行数が1になる場合は逐次実行）
+        max_processes: 最大プロセス数（0 = CPUコア予算に合わせる）
+        core_budget: ソルバーに割り当てるコア数の合計（0 = 自動検出）
+        time_limit: 施設全体の制限時間（秒）。None なら各グループ60秒
+
+    Returns:
+        list of outcome dict（tasks と同じ順序）
+    """
+    total_cores = core_budget if core_budget > 0 else detect_available_cores()
+    deadline = time.time() + time_limit if time_limit else None
+    print(f'    CPUコア予算: {total_cores}コア')
+    if deadline is not None:
+        print(f'    施設全体の制限時間: {time_limit}秒')
+
+    def make_scheduler(indices, concurrency):
+        scheduler = GroupSolveScheduler(total_cores, deadline=deadline, concurrency=concurrency)
+        for i in indices:
+            scheduler.add(i, estimate_group_difficulty(tasks[i]))
+        return scheduler
+
+    def prepare(i, workers, slice_seconds):
+        task_deadline = deadline if deadline is not None else time.time() + 2 * slice_seconds
+        return dict(tasks[i], num_workers=workers, time_limit=slice_seconds, deadline=task_deadline)
+
+    outcomes = {}
+
+    # 同時に1グループしか実行できない（1タスク・1コア・1プロセス）ならプロセスプールは使わない
+    # （pickle とプロセス起動のコストだけがかかるため、同じプロセスで逐次実行する）
+    processes = max_processes if max_processes > 0 else total_cores
+    processes = max(1, min(processes, len(tasks)))
+    if parallel and len(tasks) > 1 and processes == 1:
+        print('    同時実行数が1のため、プロセスプールを使わず逐次実行します')
+
+    if parallel and processes > 1:
+        print(f'    並列実行: {len(tasks)}グループを最大{processes}プロセスで処理します')
+
+        scheduler = make_scheduler(range(len(tasks)), processes)
+
+        try:
+            with ProcessPoolExecutor(max_workers=processes,
+                                     mp_context=_process_pool_context()) as executor:
+                running = {}
+                while scheduler.has_pending() or running:
+                    while len(running) < processes:
+                        dispatch = scheduler.next_dispatch()
+                        if dispatch is None:
+                            break
+                        i, workers, slice_seconds = dispatch
+                        if slice_seconds < MIN_SOLVE_SECONDS:
+                            scheduler.release(workers)
+                            outcomes[i] = _deadline_outcome(tasks[i])
+                            print(f'      グループ{tasks[i]["group"]}: 制限時間切れのため未計算')
+                            continue
+                        print(f'      グループ{tasks[i]["group"]}: 開始'
+                              f'（探索ワーカー{workers}、制限{slice_seconds:.0f}秒）')
+                        future = executor.submit(solve_group_task, prepare(i, workers, slice_seconds))
+                        running[future] = (i, workers)
+
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i, workers = running.pop(future)
+                        scheduler.release(workers)
+                        outcomes[i] = future.result()
+                        print(f'      グループ{tasks[i]["group"]}: 計算完了（{workers}コア返却）')
+        except Exception as e:
+            # プール起動失敗・pickle不可・ワーカー異常終了などは逐次実行にフォールバック
+            print(f'    * 並列実行に失敗しました（{type(e).__name__}: {e}）')
+            print(f'    残り{len(tasks) - len(outcomes)}グループを逐次実行に切り替えます')
+
+    # 逐次実行では1グループずつコア予算をすべて使う
+    scheduler = make_scheduler([i for i in range(len(tasks)) if i not in outcomes], 1)
+    while scheduler.has_pending():
+        i, workers, slice_seconds = scheduler.next_dispatch()
+        if slice_seconds < MIN_SOLVE_SECONDS:
+            outcomes[i] = _deadline_outcome(tasks[i])
+            print(f'    グループ{tasks[i]["group"]}: 制限時間切れのため未計算')
+        else:
+            print(f'    グループ{tasks[i]["group"]}を処理中...（制限{slice_seconds:.0f}秒）')
+            outcomes[i] = solve_group_task(prepare(i, workers, slice_seconds))
+        scheduler.release(workers)
+
+    return [outcomes[i] for i in range(len(tasks))]
+
+
+# ============================================
+# 施設横断の検証（職員×日のシフト行列で集計）
+# ============================================
+
+def facility_coverage(shift_matrix, suction_mask):
+    """
+    施設全体のシフト行列から日別の配置数を集計
+
+    施設単位のルールを追加する場合は、ここに日別（または職員別）の集計を足して
+    呼び出し側で判定する。
+
+    Args:
+        shift_matrix: 施設全体の職員×日のシフトインデックス行列（結果のない職員は-1）
+        suction_mask: 職員ごとの喀痰吸引資格者フラグ（bool配列）
+
+    Returns:
+        dict（値はいずれも日数分の int 配列。headcount のみ シフト種類×日）
+        headcount: シフト別の人数
+        working: 勤務者（休み以外）の人数
+        suction_working: 勤務している資格者の人数
+        suction_night: 夜勤の資格者の人数
+    """
+    num_shifts = len(SHIFT_KEY_ORDER)
+    assigned = shift_matrix >= 0
+    working = assigned & (shift_matrix != SHIFT_REST)
+    night = shift_matrix == SHIFT_NIGHT
+    suction = np.asarray(suction_mask, dtype=bool)[:, None]
+
+    # シフト別人数: (シフト, 日) ごとの件数を1回の bincount で数える
+    num_days = shift_matrix.shape[1]
+    day_index = np.broadcast_to(np.arange(num_days), shift_matrix.shape)
+    flat = shift_matrix[assigned].astype(np.int64) * num_days + day_index[assigned]
+    headcount = np.bincount(flat, minlength=num_shifts * num_days).reshape(num_shifts, num_days)
+
+    return {
+        'headcount': headcount,
+        'working': working.sum(axis=0),
+        'suction_working': (working & suction).sum(axis=0),
+        'suction_night': (night & suction).sum(axis=0),
+    }
+
+
+def staff_shift_summary(shift_matrix, staff_ids, groups, care_mask, prev_last_night):
+    """
+    職員別の休日・公休・夜勤回数を施設全体のシフト行列から一括で集計
 
-    result_df = pd.DataFrame(results)
-    return (True, result_df, diagnostic_info)
+    公休は夜勤明けでない休み。月初日は前月末日が夜勤なら夜勤明けとして扱う（build_group_model の公休数と同じ）。
+    結果のない職員（失敗グループ）は含めない。
+
+    Args:
+        prev_last_night: 職員ごとの「前月末日が夜勤」フラグ（bool配列）
+
+    Returns:
+        DataFrame（列: 職員ID, グループ, 勤務配慮, 休日, 公休, 夜勤明け, 夜勤）
+    """
+    rest = shift_matrix == SHIFT_REST
+    after_night = np.zeros_like(rest)
+    after_night[:, 0] = np.asarray(prev_last_night, dtype=bool)
+    after_night[:, 1:] = shift_matrix[:, :-1] == SHIFT_NIGHT
+    rest_count = rest.sum(axis=1)
+    true_holiday_count = (rest & ~after_night).sum(axis=1)
+
+    summary = pd.DataFrame({
+        '職員ID': list(staff_ids),
+        'グループ': list(groups),
+        '勤務配慮': np.asarray(care_mask, dtype=bool),
+        '休日': rest_count,
+        '公休': true_holiday_count,
+        '夜勤明け': rest_count - true_holiday_count,
+        '夜勤': (shift_matrix == SHIFT_NIGHT).sum(axis=1),
+    })
+    return summary[(shift_matrix >= 0).any(axis=1)].reset_index(drop=True)
 
 
 # ============================================
@@ -917,14 +2632,17 @@ def optimize_single_group(group, group_staff, group_holiday_df, settings_df,
 
 def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, month,
                                      shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
-                                     partial_output=True, relaxed=False):
+                                     partial_output=True, relaxed=False,
+                                     parallel=True, max_processes=0, core_budget=0,
+                                     time_limit=None, hint_df=None, diagnose=True, timings=None,
+                                     result_cache=None):
     """
     診断機能付きシフト最適化
 
     Args:
         holiday_df: 休み希望DataFrame（職員IDベース）
-        staff_df: 職員DataFrame（職員IDベース）
-        settings_df: 設定DataFrame
+        staff_df: 職員DataFrame（作成済みの StaffTable も可）
+        settings_df: 設定DataFrame（作成済みの SettingsIndex も可）
         year: 対象年
         month: 対象月
         shift_name_by_key: キー→シフト名のマッピング
@@ -932,33 +2650,71 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
         SHIFT_INFO: シフト名→時間情報
         partial_output: 部分出力を有効にするか
         relaxed: 制約緩和モード
+        parallel: グループ別最適化をプロセスプールで並列実行するか
+        max_processes: 並列実行時の最大プロセス数（0 = CPUコア予算に合わせる）
+        core_budget: ソルバーに割り当てるCPUコア数の合計（0 = 自動検出）
+        time_limit: 施設全体の制限時間（秒）。全グループ・緩和リトライで按分する
+        hint_df: 初期解ヒントにするシフト結果（load_hint_schedule の戻り値）またはNone
+        diagnose: 厳格モードで解なしのグループについて矛盾する制約の組を特定する
+        timings: 呼び出し側で計測済みのフェーズ別経過時間（診断結果の timings に引き継ぐ）
+        result_cache: 求解結果キャッシュ（ResultCache）。入力が前回と同じグループは再計算しない
 
     Returns:
-        (result_df, diagnostic_result)
+        (schedule, diagnostic_result)
+        schedule: 成功したグループのシフト結果（ShiftSchedule）。1グループも成功しなければNone
     """
     print('\n  シフト最適化を実行中（診断機能付き）...')
 
     days_in_month = calendar.monthrange(year, month)[1]
+    dates = [datetime(year, month, d) for d in range(1, days_in_month + 1)]
 
-    # 有効な職員のみ
-    active_staff = staff_df[staff_df['有効'].isin([True, 'TRUE'])].copy()
-    groups = sorted(active_staff['グループ'].unique())
-    all_staff_ids = active_staff['職員ID'].tolist()
-
-    # 全体の事前勤務指定を解析
-    all_pre_assignments = parse_pre_assignments(
-        settings_df, all_staff_ids, year, month, days_in_month
-    )
+    timings = {} if timings is None else timings
+
+    # 全体の事前勤務指定を解析（職員テーブル・設定の索引は事前診断・各グループの求解でも共有）
+    with measure_phase(timings, 'preflight'):
+        staff = StaffTable.of(staff_df)
+        settings = SettingsIndex.of(settings_df)
+        groups = list(staff.group_positions)
+        all_staff_ids = staff.ids.tolist()
+        care_staff_ids = staff.ids[staff.care].tolist()
+        all_pre_assignments, pre_assignment_conflicts = parse_pre_assignments(
+            settings, all_staff_ids, year, month, days_in_month, care_staff_ids=care_staff_ids
+        )
+        all_holiday_requests = parse_holiday_requests(holiday_df, all_staff_ids, year, month)
 
-    if all_pre_assignments:
+    if len(all_pre_assignments):
         print(f'    事前勤務指定: {len(all_pre_assignments)}件')
-        for s, d, t, staff_id, day, shift_key in all_pre_assignments:
-            print(f'      -> {staff_id} {day}日: {shift_name_by_key.get(shift_key, shift_key)} を固定')
+        for s, d, t in all_pre_assignments:
+            shift_key = SHIFT_KEY_ORDER[t]
+            print(f'      -> {all_staff_ids[s]} {d + 1}日: {shift_name_by_key.get(shift_key, shift_key)} を固定')
     else:
         print('    事前勤務指定: なし')
 
+    # 問題のある事前指定はモデル構築前に報告
+    # ハード制約と両立しない指定は所属グループが解なしになる。異なる重複指定は先頭の行で解消済み
+    if pre_assignment_conflicts:
+        print('    * 事前勤務指定の矛盾:')
+        for conflict in pre_assignment_conflicts:
+            print(f'      - {conflict["staff_id"]}: {conflict["issue"]}')
+
     # 事前診断
-    diagnostic = preflight_check(holiday_df, staff_df, settings_df, year, month, shift_name_by_key)
+    with measure_phase(timings, 'preflight'):
+        diagnostic = preflight_check(holiday_df, staff, settings, year, month, shift_name_by_key)
+    diagnostic.timings = timings
+
+    # 事前指定の矛盾は警告にとどめ、施設全体の実行は止めない
+    # ハード制約と両立しない指定は所属グループだけが解なしになり、グループの結果・解なし診断で報告される
+    group_by_staff_id = dict(zip(all_staff_ids, staff.groups.tolist()))
+    for conflict in pre_assignment_conflicts:
+        if conflict['resolved']:
+            diagnostic.add_warning('事前勤務指定', f'{conflict["staff_id"]}: {conflict["issue"]}')
+        else:
+            diagnostic.add_warning(
+                '事前勤務指定',
+                f'{conflict["staff_id"]}: {conflict["issue"]}',
+                f'グループ{group_by_staff_id[conflict["staff_id"]]}は解なしになります（他のグループは通常どおり求解）'
+            )
+            diagnostic.staff_issues.append(conflict)
 
     if diagnostic.errors:
         print('\n  * 事前診断でエラーが検出されました')
@@ -971,32 +2727,104 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
     success_groups = []
     failed_groups = []
 
-    # グループごとに最適化
+    # グループごとのタスクを作成
+    tasks = []
     for group in groups:
-        print(f'\n    グループ{group}を処理中...')
-
-        group_staff = active_staff[active_staff['グループ'] == group].copy()
-        group_staff_ids = group_staff['職員ID'].tolist()
-
-        # グループの休み希望のみ抽出（職員IDベース）
-        group_holiday = holiday_df[holiday_df['職員ID'].astype(str).isin([str(sid) for sid in group_staff_ids])]
-
-        # グループの事前勤務指定をフィルタ＆ローカルインデックスに変換
-        group_id_to_local = {sid: i for i, sid in enumerate(group_staff_ids)}
-        group_pre = []
-        for s_global, d, t, staff_id, day, shift_key in all_pre_assignments:
-            if staff_id in group_id_to_local:
-                s_local = group_id_to_local[staff_id]
-                group_pre.append((s_local, d, t, staff_id, day, shift_key))
+        group_positions = staff.group_positions[group]
+        group_staff = staff.subset(group_positions)
+        group_staff_ids = group_staff.ids.tolist()
+
+        # グループの休み希望・事前勤務指定をフィルタ＆ローカルインデックスに変換
+        group_requests = localize_staff_rows(all_holiday_requests, group_positions, len(all_staff_ids))
+        group_pre = localize_staff_rows(all_pre_assignments, group_positions, len(all_staff_ids))
+
+        group_hint = None
+        if hint_df is not None:
+            group_hint = build_shift_matrix(hint_df, group_staff_ids, dates, shift_name_by_key)
+
+        tasks.append({
+            'group': group,
+            'group_staff': group_staff,
+            'group_requests': group_requests,
+            'settings': settings,
+            'year': year,
+            'month': month,
+            'shift_name_by_key': shift_name_by_key,
+            'SHIFT_TYPES': SHIFT_TYPES,
+            'SHIFT_INFO': SHIFT_INFO,
+            'group_pre': group_pre,
+            'relaxed': relaxed,
+            'retry_relaxed': not relaxed and partial_output,
+            'diagnose': diagnose and not relaxed,
+            'hint': group_hint,
+        })
 
-        success, result, info = optimize_single_group(
-            group, group_staff, group_holiday, settings_df, year, month,
-            shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
-            group_pre, relaxed
-        )
+    # 入力が前回と同じグループは保存済みの結果を使い、変わったグループだけ求解
+    fingerprints = {}
+    cached_outcomes = {}
+    if result_cache is not None:
+        with measure_phase(timings, 'result_cache'):
+            for task in tasks:
+                fingerprint = group_task_fingerprint(task, time_limit)
+                fingerprints[task['group']] = fingerprint
+                cached = result_cache.load(fingerprint)
+                if cached is None:
+                    continue
+                # 解なし診断が途中までだった結果は、ステータスはそのまま使い診断だけやり直す
+                if needs_diagnosis(task, cached):
+                    cached = {**cached, **diagnose_group_task(task, DIAGNOSIS_TIME_LIMIT_SECONDS)}
+                    if cached['diagnosis_complete']:
+                        result_cache.store(fingerprint, cached)
+                cached_outcomes[task['group']] = {**cached, 'cached': True}
+        if cached_outcomes:
+            cached_groups = ', '.join(str(group) for group in sorted(cached_outcomes))
+            print(f'    保存済みの結果を使用: グループ{cached_groups}（入力が前回と同じ）')
+    pending_tasks = [task for task in tasks if task['group'] not in cached_outcomes]
+
+    # グループごとに最適化（並列 or 逐次）
+    solved_outcomes = []
+    with measure_phase(timings, 'groups'):
+        if pending_tasks:
+            solved_outcomes = run_group_tasks(pending_tasks, parallel=parallel, max_processes=max_processes,
+                                              core_budget=core_budget, time_limit=time_limit)
+
+    if result_cache is not None:
+        task_by_group = {task['group']: task for task in pending_tasks}
+        for outcome in solved_outcomes:
+            if is_cacheable_outcome(task_by_group[outcome['group']], outcome):
+                result_cache.store(fingerprints[outcome['group']], cacheable_outcome(outcome))
+
+    outcome_by_group = {outcome['group']: outcome for outcome in solved_outcomes}
+    outcome_by_group.update(cached_outcomes)
+    outcomes = [outcome_by_group[group] for group in groups]
+
+    # グループ内のフェーズ時間を全体で合計（並列実行時は 'groups' の実時間より大きくなる）
+    # 保存済みの結果は今回計算していないので含めない
+    for outcome in outcomes:
+        if outcome.get('cached'):
+            continue
+        group_infos = [outcome['info']]
+        if outcome['retry'] is not None:
+            group_infos.append(outcome['retry'][2])
+        for group_info in group_infos:
+            for phase, seconds in group_info.get('timings', {}).items():
+                key = f'group_{phase}'
+                timings[key] = round(timings.get(key, 0.0) + seconds, 3)
+
+    for outcome in outcomes:
+        group = outcome['group']
+        success, result, info = outcome['success'], outcome['result'], outcome['info']
+        print(f'\n    グループ{group}の結果:')
+
+        if outcome.get('cached'):
+            print(f'      グループ{group}: 入力が前回と同じため保存済みの結果を使用')
+            info = {**info, 'cached': True}
 
         if success:
-            print(f'      グループ{group}: 成功')
+            print(f'      グループ{group}: 成功（{format_solver_summary(info)}）')
+            if 'hint_cells' in info:
+                print(f'      ヒントからの変更: {info["hint_changed_cells"]}/{info["hint_cells"]}セル'
+                      f'（{info["hint_changed_staff"]}名）')
             all_results.append(result)
             success_groups.append(group)
             diagnostic.group_results[group] = {
@@ -1013,16 +2841,20 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
                 'details': info
             }
 
-            # 緩和モードで再試行
-            if not relaxed and partial_output:
+            # 解なし診断で特定した矛盾する制約の組
+            if outcome['conflicts']:
+                print(f'      グループ{group}: 両立しない制約の組')
+                for conflict in outcome['conflicts']:
+                    print(f'        - {conflict["staff_id"]}: {conflict["issue"]}')
+                diagnostic.staff_issues.extend(outcome['conflicts'])
+
+            # 緩和モードでの再試行結果
+            if outcome['retry'] is not None:
                 print(f'      グループ{group}: 制約緩和モードで再試行...')
-                success2, result2, info2 = optimize_single_group(
-                    group, group_staff, group_holiday, settings_df, year, month,
-                    shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
-                    group_pre, relaxed=True
-                )
+                success2, result2, info2 = outcome['retry']
+                diagnostic.group_results[group]['retry_details'] = info2
                 if success2:
-                    print(f'      グループ{group}: 緩和モードで成功（制約違反あり）')
+                    print(f'      グループ{group}: 緩和モードで成功（制約違反あり、{format_solver_summary(info2)}）')
                     all_results.append(result2)
                     diagnostic.group_results[group]['relaxed_success'] = True
                     diagnostic.add_warning(
@@ -1031,41 +2863,30 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
                         '最低人数や所定勤務日数が一部守られていない可能性があります'
                     )
 
+    verification_start = time.perf_counter()
+
     # 結果をまとめる
     if all_results:
-        combined_df = pd.concat(all_results, ignore_index=True)
+        schedule = ShiftSchedule.concat(all_results)
     else:
-        combined_df = None
+        schedule = None
 
     # ============================================
     # 施設横断: 喀痰吸引資格者の全日配置チェック（法的要件）
     # 全グループ合算で、毎日最低1名の資格者が勤務していることを検証
+    # 結果を施設全体の職員×日のシフト行列にして1回で集計する
     # ============================================
-    if combined_df is not None:
-        yasumi_name = shift_name_by_key[SHIFT_KEY_YASUMI]
-
-        # 資格者の職員IDセット
-        suction_staff_ids = set(
-            str(row['職員ID']) for _, row in active_staff.iterrows()
-            if row.get('喀痰吸引資格者', '') in (True, 'TRUE', '有', 'あり')
-        )
-
-        print(f'\n  施設横断 喀痰吸引資格者チェック（資格者{len(suction_staff_ids)}名）...')
-
-        violation_days = []
-        for day in range(1, days_in_month + 1):
-            date_str = f'{year}-{str(month).zfill(2)}-{str(day).zfill(2)}'
-            day_shifts = combined_df[combined_df['勤務開始日'] == date_str]
-
-            # この日に勤務している（休み以外の）資格者を検索
-            working_qualified = day_shifts[
-                (day_shifts['職員ID'].astype(str).isin(suction_staff_ids)) &
-                (day_shifts['シフト名'] != yasumi_name)
-            ]
+    if schedule is not None:
+        facility_matrix = schedule.matrix_for(all_staff_ids)
+        suction_mask = staff.suction
+        coverage = facility_coverage(facility_matrix, suction_mask)
+        diagnostic.facility_headcount = {
+            SHIFT_TYPES[t]: coverage['headcount'][t].tolist() for t in range(len(SHIFT_TYPES))
+        }
 
-            if len(working_qualified) == 0:
-                violation_days.append(day)
+        print(f'\n  施設横断 喀痰吸引資格者チェック（資格者{int(suction_mask.sum())}名）...')
 
+        violation_days = (np.flatnonzero(coverage['suction_working'] == 0) + 1).tolist()
         if violation_days:
             diagnostic.add_error(
                 '喀痰吸引資格者（施設横断）',
@@ -1074,28 +2895,12 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
             )
             print(f'    NG: {len(violation_days)}日間の違反あり')
             for day in violation_days:
-                date_str = f'{year}-{str(month).zfill(2)}-{str(day).zfill(2)}'
-                day_shifts = combined_df[combined_df['勤務開始日'] == date_str]
-                working_all = day_shifts[day_shifts['シフト名'] != yasumi_name]
-                print(f'      {month}/{day}: 勤務者{len(working_all)}名中、資格者0名')
+                print(f'      {month}/{day}: 勤務者{coverage["working"][day - 1]}名中、資格者0名')
         else:
             print(f'    OK: 全{days_in_month}日間、資格者が配置されています')
 
         # 施設横断: 資格者の夜勤配置チェック
-        yakin_name = shift_name_by_key[SHIFT_KEY_YAKIN]
-        night_violation_days = []
-        for day in range(1, days_in_month + 1):
-            date_str = f'{year}-{str(month).zfill(2)}-{str(day).zfill(2)}'
-            day_shifts = combined_df[combined_df['勤務開始日'] == date_str]
-
-            night_qualified = day_shifts[
-                (day_shifts['職員ID'].astype(str).isin(suction_staff_ids)) &
-                (day_shifts['シフト名'] == yakin_name)
-            ]
-
-            if len(night_qualified) == 0:
-                night_violation_days.append(day)
-
+        night_violation_days = (np.flatnonzero(coverage['suction_night'] == 0) + 1).tolist()
         if night_violation_days:
             diagnostic.add_error(
                 '喀痰吸引資格者・夜勤（施設横断）',
@@ -1108,17 +2913,30 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
         else:
             print(f'    夜勤 OK: 全{days_in_month}日間、夜勤に資格者が配置されています')
 
-    # 失敗グループへの対策提案
+        # 施設全体の日別人数（シフト別の最少〜最多）
+        headcount_ranges = ', '.join(
+            f'{SHIFT_TYPES[t]}{counts.min()}〜{counts.max()}名'
+            for t, counts in enumerate(coverage['headcount']) if t != SHIFT_REST
+        )
+        print(f'    日別人数（施設合計）: {headcount_ranges}')
+
+    # 失敗グループへの対策提案（人数は事前診断のグループ別集計を使う）
     for group in failed_groups:
         group_info = diagnostic.group_results[group].get('details', {})
+        group_counts = diagnostic.group_aggregates.loc[group]
 
-        if group_info.get('night_capable', 0) == 0:
+        if group_info.get('deadline_exceeded'):
+            diagnostic.add_suggestion(
+                f'グループ{group}: 施設全体の制限時間内に計算できませんでした。'
+                f'FACILITY_TIME_LIMIT_SECONDS を延ばして再実行してください'
+            )
+        elif group_counts['夜勤可能者'] == 0:
             diagnostic.add_suggestion(
                 f'グループ{group}: 夜勤可能な職員を最低1名配置してください'
             )
-        elif group_info.get('staff_count', 0) < 5:
+        elif group_counts['人数'] < 5:
             diagnostic.add_suggestion(
-                f'グループ{group}: 職員を{5 - group_info.get("staff_count", 0)}名以上増員してください'
+                f'グループ{group}: 職員を{5 - group_counts["人数"]}名以上増員してください'
             )
         else:
             diagnostic.add_suggestion(
@@ -1130,100 +2948,52 @@ def optimize_shift_with_diagnostics(holiday_df, staff_df, settings_df, year, mon
     print(f'    成功グループ: {success_groups if success_groups else "なし"}')
     print(f'    失敗グループ: {failed_groups if failed_groups else "なし"}')
 
-    if combined_df is not None:
-        print(f'    出力レコード数: {len(combined_df)}件')
+    if schedule is not None:
+        print(f'    出力レコード数: {len(schedule)}件')
 
-        for shift_type in SHIFT_TYPES:
-            count = len(combined_df[combined_df['シフト名'] == shift_type])
-            print(f'    {shift_type}: {count}件')
+        for t, shift_type in enumerate(SHIFT_TYPES):
+            print(f'    {shift_type}: {int(coverage["headcount"][t].sum())}件')
 
-        # 公休数確認
+        # 公休数確認・夜勤配分（職員別の集計は診断レポートにも保存）
         yakin_name = shift_name_by_key[SHIFT_KEY_YAKIN]
-        yasumi_name = shift_name_by_key[SHIFT_KEY_YASUMI]
-        monthly_holidays_val = int(get_setting(
-            settings_df,
-            f'MONTHLY_HOLIDAYS_{year}{str(month).zfill(2)}',
-            9
-        ))
+        monthly_holidays_val = settings.monthly_holidays(year, month)
+        prev_last_night = np.array(
+            [settings.prev_tail(staff_id)[1] == SHIFT_KEY_YAKIN for staff_id in all_staff_ids], dtype=bool
+        )
+        staff_summary = staff_shift_summary(
+            facility_matrix, all_staff_ids, staff.groups.tolist(), staff.care, prev_last_night
+        )
+        diagnostic.staff_summary = staff_summary.to_dict('records')
 
         print(f'\n  公休数確認（目標{monthly_holidays_val}日、夜勤明けの休みは公休外）:')
-        for staff_id in active_staff['職員ID'].tolist():
-            staff_shifts = combined_df[combined_df['職員ID'] == staff_id]
-            if len(staff_shifts) == 0:
-                continue
-            staff_shifts_sorted = staff_shifts.sort_values('勤務開始日')
-            shift_list = staff_shifts_sorted['シフト名'].tolist()
-
-            rest_count = shift_list.count(yasumi_name)
-            night_count = shift_list.count(yakin_name)
-
-            # 公休数を計算（夜勤明けの休みを除外）
-            true_holiday_count = 0
-            for d_idx, sname in enumerate(shift_list):
-                if sname == yasumi_name:
-                    if d_idx == 0 or shift_list[d_idx - 1] != yakin_name:
-                        true_holiday_count += 1
-
-            mark = '  ' if true_holiday_count == monthly_holidays_val else '* '
-            print(f'    {mark}{staff_id}: 公休{true_holiday_count}日（休日{rest_count}日中、夜勤明け{rest_count - true_holiday_count}日除外）, '
-                  f'{yakin_name}{night_count}回')
+        for row in staff_summary.itertuples(index=False):
+            mark = '  ' if row.公休 == monthly_holidays_val else '* '
+            print(f'    {mark}{row.職員ID}: 公休{row.公休}日（休日{row.休日}日中、夜勤明け{row.夜勤明け}日除外）, '
+                  f'{yakin_name}{row.夜勤}回')
 
         # 夜勤配分確認
         print(f'\n  {yakin_name}配分:')
-        for _, staff_row in active_staff.iterrows():
-            staff_id = staff_row['職員ID']
-            care_value = staff_row.get('勤務配慮', '')
-            if care_value not in (True, 'TRUE', '有', 'あり'):
-                staff_shifts = combined_df[combined_df['職員ID'] == staff_id]
-                if len(staff_shifts) == 0:
-                    continue
-                night_count = len(staff_shifts[staff_shifts['シフト名'] == yakin_name])
-                print(f'    {staff_id}: {night_count}回')
+        for row in staff_summary[~staff_summary['勤務配慮']].itertuples(index=False):
+            print(f'    {row.職員ID}: {row.夜勤}回')
 
-    diagnostic.partial_results = combined_df
+    timings['verification'] = round(time.perf_counter() - verification_start, 3)
+    diagnostic.partial_results = schedule
 
-    return (combined_df, diagnostic)
+    return (schedule, diagnostic)
 
 
 # ============================================
 # CSV保存
 # ============================================
 
-def save_result_to_drive(result_df, year, month, suffix=''):
-    """シフト結果をDriveに保存"""
-    creds = authenticate_drive()
-    service = build('drive', 'v3', credentials=creds)
-
-    csv_buffer = io.BytesIO()
-    result_df.to_csv(csv_buffer, index=False, encoding='utf-8')
-    csv_buffer.seek(0)
-
+def save_result(storage, schedule, year, month, suffix=''):
+    """シフト結果CSVを保存（schedule は ShiftSchedule）"""
     year_month = f'{year}{str(month).zfill(2)}'
     file_name = f'シフト結果_{year_month}{suffix}.csv'
 
-    # 既存ファイル削除
-    query = f"name='{file_name}' and '{OUTPUT_FOLDER_ID}' in parents and trashed=false"
-    results = service.files().list(q=query, fields='files(id)').execute()
-    for file in results.get('files', []):
-        service.files().delete(fileId=file['id']).execute()
-        print(f'  既存ファイル削除: {file_name}')
-
-    file_metadata = {
-        'name': file_name,
-        'parents': [OUTPUT_FOLDER_ID],
-        'mimeType': 'text/csv'
-    }
-
-    media = MediaIoBaseUpload(csv_buffer, mimetype='text/csv', resumable=True)
-
-    file = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields='id'
-    ).execute()
-
-    file_id = file.get('id')
-    print(f'  {file_name} をDriveに保存しました (ID: {file_id})')
+    data = schedule.to_csv_bytes()
+    file_id = storage.write_file(file_name, data, 'text/csv')
+    print(f'  {file_name} を{storage.label}に保存しました (ID: {file_id})')
 
     return file_id
 
@@ -1232,39 +3002,17 @@ def save_result_to_drive(result_df, year, month, suffix=''):
 # 診断レポート保存
 # ============================================
 
-def save_diagnostic_report(diagnostic, year, month):
-    """診断レポートをDriveにJSON保存"""
-    creds = authenticate_drive()
-    service = build('drive', 'v3', credentials=creds)
-
+def save_diagnostic_report(storage, diagnostic, year, month):
+    """診断レポートをJSON保存"""
     report = diagnostic.to_dict()
-    json_buffer = io.BytesIO(json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8'))
+    data = json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8')
 
     year_month = f'{year}{str(month).zfill(2)}'
     file_name = f'診断レポート_{year_month}.json'
 
-    # 既存ファイル削除
-    query = f"name='{file_name}' and '{OUTPUT_FOLDER_ID}' in parents and trashed=false"
-    results = service.files().list(q=query, fields='files(id)').execute()
-    for file in results.get('files', []):
-        service.files().delete(fileId=file['id']).execute()
-
-    file_metadata = {
-        'name': file_name,
-        'parents': [OUTPUT_FOLDER_ID],
-        'mimeType': 'application/json'
-    }
-
-    media = MediaIoBaseUpload(json_buffer, mimetype='application/json', resumable=True)
-
-    file = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields='id'
-    ).execute()
-
-    print(f'  {file_name} をDriveに保存しました')
-    return file.get('id')
+    file_id = storage.write_file(file_name, data, 'application/json')
+    print(f'  {file_name} を{storage.label}に保存しました')
+    return file_id
 
 
 # ============================================
@@ -1309,8 +3057,16 @@ def notify_gas_webhook(file_id, year, month):
 # メイン処理
 # ============================================
 
-def main():
-    """メイン処理"""
+def main(storage=None):
+    """
+    メイン処理
+
+    Args:
+        storage: 入出力先（StorageBackend）。省略時はフォーム設定（STORAGE_BACKEND）から作成
+
+    Returns:
+        シフト結果（ShiftSchedule、DataFrameは to_dataframe() で取得）。結果がなければNone
+    """
     print(f'\n{"="*60}')
     print(f'シフト計算開始: {TARGET_YEAR}年{TARGET_MONTH}月')
     print(f'{"="*60}\n')
@@ -1318,37 +3074,71 @@ def main():
     print(f'設定:')
     print(f'  部分出力モード: {"有効" if ENABLE_PARTIAL_OUTPUT else "無効"}')
     print(f'  制約緩和モード: {"有効" if RELAXED_MODE else "無効"}')
+    print(f'  解なし診断: {"有効" if DIAGNOSE_INFEASIBILITY else "無効"}')
+    print(f'  グループ並列実行: {"有効" if PARALLEL_GROUPS else "無効"}')
+    print(f'  ウォームスタート: {HINT_SOURCE}')
+    print(f'  求解結果キャッシュ: {"有効" if RESULT_CACHE_ENABLED else "無効"}')
+
+    if storage is None:
+        storage = create_storage()
+    print(f'  入出力先: {storage.label}')
+
+    # フェーズ別の経過時間（秒）。診断レポートの timings として保存する
+    timings = {}
+    run_start = time.perf_counter()
 
     try:
         # [1/6] CSV読込
         print('\n[1/6] CSV読込')
-        holiday_df, staff_df, settings_df = load_all_input_data(TARGET_YEAR, TARGET_MONTH)
+        with measure_phase(timings, 'load'):
+            holiday_df, staff_df, settings_df = load_all_input_data(storage, TARGET_YEAR, TARGET_MONTH)
+            staff = StaffTable.from_dataframe(staff_df)
 
         # [2/6] 動的シフト名解決
         print('\n[2/6] 動的シフト名解決')
-        shift_name_by_key, SHIFT_TYPES, SHIFT_INFO = resolve_shift_names(settings_df)
+        with measure_phase(timings, 'settings'):
+            settings = SettingsIndex(settings_df)
+            shift_name_by_key, SHIFT_TYPES, SHIFT_INFO = resolve_shift_names(settings)
         print(f'  シフト種類: {SHIFT_TYPES}')
 
+        hint_df = None
+        if HINT_SOURCE != 'none':
+            with measure_phase(timings, 'load'):
+                hint_df = load_hint_schedule(storage, TARGET_YEAR, TARGET_MONTH, HINT_SOURCE)
+
+        result_cache = None
+        if RESULT_CACHE_ENABLED:
+            result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024)
+
         # [3/6] 事前診断 + グループ別最適化
         print('\n[3/6] 事前診断')
         print('\n[4/6] グループ別最適化')
-        result_df, diagnostic = optimize_shift_with_diagnostics(
-            holiday_df, staff_df, settings_df,
+        schedule, diagnostic = optimize_shift_with_diagnostics(
+            holiday_df, staff, settings,
             TARGET_YEAR, TARGET_MONTH,
             shift_name_by_key, SHIFT_TYPES, SHIFT_INFO,
             partial_output=ENABLE_PARTIAL_OUTPUT,
-            relaxed=RELAXED_MODE
+            relaxed=RELAXED_MODE,
+            parallel=PARALLEL_GROUPS,
+            max_processes=MAX_PARALLEL_PROCESSES,
+            core_budget=SOLVER_CORE_BUDGET,
+            time_limit=FACILITY_TIME_LIMIT_SECONDS,
+            hint_df=hint_df,
+            diagnose=DIAGNOSE_INFEASIBILITY,
+            timings=timings,
+            result_cache=result_cache
         )
 
         # 診断レポート出力
         diagnostic.print_report()
 
-        if result_df is None or len(result_df) == 0:
+        if schedule is None or len(schedule) == 0:
             print('\n出力可能な結果がありません')
 
             # 診断レポートのみ保存
             print('\n[5/6] 診断レポート保存')
-            save_diagnostic_report(diagnostic, TARGET_YEAR, TARGET_MONTH)
+            timings['total'] = round(time.perf_counter() - run_start, 3)
+            save_diagnostic_report(storage, diagnostic, TARGET_YEAR, TARGET_MONTH)
 
             print(f'\n{"="*60}')
             print('シフト計算に失敗しました')
@@ -1358,7 +3148,7 @@ def main():
 
         # 結果プレビュー
         print('\n結果プレビュー（最初の20件）:')
-        print(result_df.head(20))
+        print(schedule.head(20))
 
         # [5/6] CSV保存 + 診断レポート保存
         print('\n[5/6] CSV保存 + 診断レポート保存')
@@ -1370,17 +3160,28 @@ def main():
         if is_partial:
             print('  * 部分的な結果が含まれています（ファイル名は通常通り）')
 
-        file_id = save_result_to_drive(result_df, TARGET_YEAR, TARGET_MONTH)
-        save_diagnostic_report(diagnostic, TARGET_YEAR, TARGET_MONTH)
+        with measure_phase(timings, 'save'):
+            file_id = save_result(storage, schedule, TARGET_YEAR, TARGET_MONTH)
 
         # [6/6] Webhook通知（完全成功時のみ）
         print('\n[6/6] Webhook通知')
-        if not is_partial:
-            webhook_result = notify_gas_webhook(file_id, TARGET_YEAR, TARGET_MONTH)
+        if not storage.supports_webhook:
+            print(f'  * {storage.label}保存のためWebhook送信をスキップ（GASはDriveのファイルのみ取り込み可能）')
+            webhook_result = {'success': True, 'message': f'スキップ（{storage.label}保存）'}
+        elif not is_partial:
+            with measure_phase(timings, 'webhook'):
+                webhook_result = notify_gas_webhook(file_id, TARGET_YEAR, TARGET_MONTH)
         else:
             print('  * 部分的な結果のためWebhook送信をスキップ')
             webhook_result = {'success': True, 'message': 'スキップ（部分結果）'}
 
+        # 診断レポートは保存・通知の時間も含めて最後に保存する
+        timings['total'] = round(time.perf_counter() - run_start, 3)
+        save_diagnostic_report(storage, diagnostic, TARGET_YEAR, TARGET_MONTH)
+        print(f'  処理時間: 合計{timings["total"]:.1f}秒'
+              f'（読込{timings.get("load", 0):.1f}秒 / 最適化{timings.get("groups", 0):.1f}秒'
+              f' / 保存{timings.get("save", 0):.1f}秒）')
+
         print(f'\n{"="*60}')
         if webhook_result.get('success') and not is_partial:
             print('すべての処理が完了しました！')
@@ -1400,7 +3201,7 @@ def main():
             print(f'     失敗グループは手動でシフト作成')
         print(f'{"="*60}\n')
 
-        return result_df
+        return schedule
 
     except Exception as e:
         print(f'\nエラー: {e}')
@@ -0,0 +1,61 @@
+"""
+グループ別タスク実行（run_group_tasks）のテスト
+
+同時実行数が1になる場合はプロセスプールを起動せず、同じプロセスで逐次実行することを確認する。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import shift_optimizer as so  # noqa: E402
+
+
+def make_tasks(num_groups):
+    return [{
+        'group': group,
+        'group_staff': ['s'] * 5,
+        'group_requests': np.empty((0, 3), dtype=np.int32),
+        'group_pre': np.empty((0, 3), dtype=np.int32),
+        'year': 2025,
+        'month': 12,
+    } for group in range(1, num_groups + 1)]
+
+
+@pytest.fixture
+def pool_starts(monkeypatch):
+    """プロセスプールの起動を記録し（起動は失敗させて逐次実行に切り替える）、求解は即座に返す"""
+    starts = []
+
+    def failing_pool(max_workers, mp_context=None):
+        starts.append(max_workers)
+        raise RuntimeError('pool disabled in test')
+
+    monkeypatch.setattr(so, 'ProcessPoolExecutor', failing_pool)
+    monkeypatch.setattr(so, 'solve_group_task', lambda task: {'group': task['group'], 'pid': os.getpid()})
+    return starts
+
+
+@pytest.mark.parametrize('num_groups, core_budget, max_processes', [
+    (3, 1, 0),   # 1コア
+    (3, 4, 1),   # 最大1プロセス
+    (1, 4, 0),   # 1グループ
+])
+def test_single_worker_runs_in_process(pool_starts, num_groups, core_budget, max_processes):
+    outcomes = so.run_group_tasks(make_tasks(num_groups), parallel=True,
+                                  max_processes=max_processes, core_budget=core_budget, time_limit=60)
+
+    assert pool_starts == []
+    assert [outcome['group'] for outcome in outcomes] == list(range(1, num_groups + 1))
+    assert all(outcome['pid'] == os.getpid() for outcome in outcomes)
+
+
+def test_multiple_workers_use_process_pool(pool_starts):
+    outcomes = so.run_group_tasks(make_tasks(3), parallel=True, core_budget=2, time_limit=60)
+
+    assert pool_starts == [2]
+    assert [outcome['group'] for outcome in outcomes] == [1, 2, 3]
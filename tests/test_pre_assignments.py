@@ -0,0 +1,124 @@
+"""
+事前勤務指定の解析のテスト
+
+ハード制約と両立しない指定を種類ごとに検出すること、
+矛盾する指定（重複・ハード制約違反）があっても施設全体の実行を止めないことを確認する。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import shift_benchmark as sb  # noqa: E402
+import shift_optimizer as so  # noqa: E402
+
+
+def with_duplicate_assign(settings_df, staff_id):
+    """同じ職員・日に異なる2つの事前指定を追加"""
+    rows = pd.DataFrame({
+        '設定ID': [f'ASSIGN_{staff_id}_20251210'] * 2,
+        '設定値': [so.SHIFT_KEY_HAYADE, so.SHIFT_KEY_NIKKIN],
+    })
+    settings_df = settings_df[~settings_df['設定ID'].astype(str).str.startswith('ASSIGN_')]
+    return pd.concat([settings_df, rows], ignore_index=True)
+
+
+def parse(settings_rows, care_staff_ids=()):
+    """職員 s1 だけの設定行（設定ID → 設定値）を2025年12月分として解析"""
+    settings = so.SettingsIndex(pd.DataFrame({
+        '設定ID': list(settings_rows), '設定値': list(settings_rows.values())
+    }))
+    return so.parse_pre_assignments(settings, ['s1'], 2025, 12, 31, care_staff_ids=care_staff_ids)
+
+
+@pytest.mark.parametrize('settings_rows, care_staff_ids, expected', [
+    # 夜勤の翌日・翌々日は休み
+    ({'ASSIGN_s1_20251210': so.SHIFT_KEY_YAKIN, 'ASSIGN_s1_20251211': so.SHIFT_KEY_HAYADE}, (),
+     '10日の夜勤の明け（11日）'),
+    ({'ASSIGN_s1_20251210': so.SHIFT_KEY_YAKIN, 'ASSIGN_s1_20251212': so.SHIFT_KEY_NIKKIN}, (),
+     '10日の夜勤の明け（12日）'),
+    ({'PREV_LAST_SHIFT_s1': so.SHIFT_KEY_YAKIN, 'ASSIGN_s1_20251201': so.SHIFT_KEY_NIKKIN}, (),
+     '前月末日の夜勤の明け（1日）'),
+    ({'PREV_2ND_LAST_SHIFT_s1': so.SHIFT_KEY_YAKIN, 'ASSIGN_s1_20251201': so.SHIFT_KEY_OSODE}, (),
+     '前月末日の前日の夜勤の明け（1日）'),
+    # 遅出→翌日早出は禁止
+    ({'ASSIGN_s1_20251210': so.SHIFT_KEY_OSODE, 'ASSIGN_s1_20251211': so.SHIFT_KEY_HAYADE}, (),
+     '10日の遅出の翌日（11日）'),
+    ({'PREV_LAST_SHIFT_s1': so.SHIFT_KEY_OSODE, 'ASSIGN_s1_20251201': so.SHIFT_KEY_HAYADE}, (),
+     '前月末日の遅出の翌日（1日）'),
+    # 勤務配慮の職員は夜勤免除
+    ({'ASSIGN_s1_20251210': so.SHIFT_KEY_YAKIN}, ('s1',),
+     '10日に夜勤が指定されていますが、勤務配慮'),
+])
+def test_hard_conflicts_are_detected(settings_rows, care_staff_ids, expected):
+    _, conflicts = parse(settings_rows, care_staff_ids)
+
+    assert len(conflicts) == 1
+    assert conflicts[0]['staff_id'] == 's1'
+    assert expected in conflicts[0]['issue']
+    assert not conflicts[0]['resolved']
+
+
+def test_compatible_assigns_have_no_conflicts():
+    _, conflicts = parse({
+        'PREV_LAST_SHIFT_s1': so.SHIFT_KEY_YAKIN,
+        'ASSIGN_s1_20251201': so.SHIFT_KEY_YASUMI,
+        'ASSIGN_s1_20251210': so.SHIFT_KEY_HAYADE,
+        'ASSIGN_s1_20251211': so.SHIFT_KEY_OSODE,
+        'ASSIGN_s1_20251212': so.SHIFT_KEY_NIKKIN,
+    })
+
+    assert conflicts == []
+
+
+def test_duplicate_assign_is_resolved_to_first_row():
+    settings = so.SettingsIndex(with_duplicate_assign(
+        pd.DataFrame({'設定ID': [], '設定値': []}), 's1'
+    ))
+    pre_assignments, conflicts = so.parse_pre_assignments(settings, ['s1'], 2025, 12, 31)
+
+    assert pre_assignments.tolist() == [[0, 9, so.SHIFT_KEY_ORDER.index(so.SHIFT_KEY_HAYADE)]]
+    assert len(conflicts) == 1
+    assert conflicts[0]['resolved']
+
+
+def test_duplicate_assign_does_not_abort_strict_run():
+    holiday_df, staff_df, settings_df = sb.generate_instance(groups=1, staff_per_group=8)
+    staff_id = staff_df['職員ID'].iloc[0]
+    settings = so.SettingsIndex(with_duplicate_assign(settings_df, staff_id))
+    names = so.resolve_shift_names(settings)
+
+    schedule, diagnostic = so.optimize_shift_with_diagnostics(
+        holiday_df, staff_df, settings, 2025, 12, *names,
+        partial_output=False, parallel=False, time_limit=5, diagnose=False
+    )
+
+    assert schedule is not None
+    assert '事前勤務指定' not in [error['category'] for error in diagnostic.errors]
+    assert [warning['category'] for warning in diagnostic.warnings].count('事前勤務指定') == 1
+
+
+def test_hard_conflict_fails_only_its_group():
+    holiday_df, staff_df, settings_df = sb.generate_instance(groups=2, staff_per_group=8, assign_density=0)
+    staff_id = staff_df.loc[staff_df['グループ'] == 1, '職員ID'].iloc[0]
+    settings_df = pd.concat([settings_df, pd.DataFrame({
+        '設定ID': [f'ASSIGN_{staff_id}_20251210', f'ASSIGN_{staff_id}_20251211'],
+        '設定値': [so.SHIFT_KEY_OSODE, so.SHIFT_KEY_HAYADE],
+    })], ignore_index=True)
+    settings = so.SettingsIndex(settings_df)
+    names = so.resolve_shift_names(settings)
+
+    schedule, diagnostic = so.optimize_shift_with_diagnostics(
+        holiday_df, staff_df, settings, 2025, 12, *names,
+        partial_output=False, parallel=False, time_limit=10, diagnose=False
+    )
+
+    assert '事前勤務指定' not in [error['category'] for error in diagnostic.errors]
+    assert not diagnostic.group_results[1]['success']
+    assert diagnostic.group_results[2]['success']
+    assert schedule is not None and set(schedule.groups.tolist()) == {2}
+    assert any(issue['staff_id'] == staff_id for issue in diagnostic.staff_issues)
@@ -0,0 +1,145 @@
+"""
+求解結果キャッシュのテスト
+
+時間切れで打ち切った FEASIBLE の結果は保存せず、次回の実行で再計算すること、
+途中までの解なし診断は保存せず、キャッシュから使うときに診断をやり直すことを確認する。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import shift_benchmark as sb  # noqa: E402
+import shift_optimizer as so  # noqa: E402
+
+
+@pytest.fixture
+def instance():
+    holiday_df, staff_df, settings_df = sb.generate_instance(groups=1, staff_per_group=8)
+    settings = so.SettingsIndex(settings_df)
+    return holiday_df, so.StaffTable.from_dataframe(staff_df), settings, so.resolve_shift_names(settings)
+
+
+def force_status(monkeypatch, status):
+    """solve_group_model の結果のステータスを差し替え、求解回数を数える"""
+    calls = []
+    solve = so.solve_group_model
+
+    def solve_with_status(*args, **kwargs):
+        success, result, info = solve(*args, **kwargs)
+        calls.append(info['status'])
+        return success, result, {**info, 'status': status}
+
+    monkeypatch.setattr(so, 'solve_group_model', solve_with_status)
+    return calls
+
+
+@pytest.fixture
+def infeasible_instance():
+    """遅出→翌日早出の事前指定でグループ1が解なしになる入力"""
+    holiday_df, staff_df, settings_df = sb.generate_instance(
+        groups=1, staff_per_group=8, tail_ratio=0, assign_density=0
+    )
+    staff_id = staff_df['職員ID'].iloc[0]
+    settings_df = pd.concat([settings_df, pd.DataFrame({
+        '設定ID': [f'ASSIGN_{staff_id}_20251210', f'ASSIGN_{staff_id}_20251211'],
+        '設定値': [so.SHIFT_KEY_OSODE, so.SHIFT_KEY_HAYADE],
+    })], ignore_index=True)
+    settings = so.SettingsIndex(settings_df)
+    return holiday_df, so.StaffTable.from_dataframe(staff_df), settings, so.resolve_shift_names(settings)
+
+
+def run(instance, result_cache, diagnose=False, time_limit=2):
+    holiday_df, staff, settings, names = instance
+    year, month = sb.DEFAULT_INSTANCE['year'], sb.DEFAULT_INSTANCE['month']
+    return so.optimize_shift_with_diagnostics(
+        holiday_df, staff, settings, year, month, *names,
+        parallel=False, time_limit=time_limit, diagnose=diagnose, result_cache=result_cache
+    )
+
+
+def test_time_limited_feasible_result_is_solved_again(instance, monkeypatch, tmp_path):
+    calls = force_status(monkeypatch, 'FEASIBLE')
+    result_cache = so.ResultCache(str(tmp_path), 10 * 1024 * 1024)
+
+    schedule, _ = run(instance, result_cache)
+    assert schedule is not None
+    assert len(calls) == 1
+
+    run(instance, result_cache)
+    assert len(calls) == 2
+
+
+def test_optimal_result_is_served_from_cache(instance, monkeypatch, tmp_path):
+    calls = force_status(monkeypatch, 'OPTIMAL')
+    result_cache = so.ResultCache(str(tmp_path), 10 * 1024 * 1024)
+
+    run(instance, result_cache)
+    schedule, diagnostic = run(instance, result_cache)
+    assert len(calls) == 1
+    assert schedule is not None
+    assert diagnostic.group_results[1]['details']['cached']
+
+
+def diagnosed_issues(diagnostic):
+    """解なし診断で特定した矛盾（事前指定の解析で見つかったものを除く）"""
+    return [issue for issue in diagnostic.staff_issues if '両立しません' in issue['issue']]
+
+
+def test_incomplete_diagnosis_is_redone_on_cache_hit(infeasible_instance, monkeypatch, tmp_path):
+    diagnose = so.diagnose_infeasibility
+    diagnoses = []
+
+    def diagnose_cut_short(group_model, time_limit):
+        """1回目は時間切れで途中まで（原因の一部だけ）の診断を返す"""
+        issues, complete = diagnose(group_model, time_limit)
+        diagnoses.append(complete)
+        if len(diagnoses) == 1:
+            return issues, False
+        return issues, complete
+
+    monkeypatch.setattr(so, 'diagnose_infeasibility', diagnose_cut_short)
+    result_cache = so.ResultCache(str(tmp_path), 10 * 1024 * 1024)
+
+    _, diagnostic = run(infeasible_instance, result_cache, diagnose=True, time_limit=20)
+    assert not diagnostic.group_results[1]['success']
+    assert len(diagnoses) == 1
+
+    # 保存済みの結果（解なし）を使い、診断だけやり直す
+    _, diagnostic = run(infeasible_instance, result_cache, diagnose=True, time_limit=20)
+    assert diagnostic.group_results[1]['details']['cached']
+    assert len(diagnoses) == 2
+    assert diagnosed_issues(diagnostic)
+
+    # やり直した診断は完了しているので保存され、次回は診断もしない
+    _, diagnostic = run(infeasible_instance, result_cache, diagnose=True, time_limit=20)
+    assert len(diagnoses) == 2
+    assert diagnosed_issues(diagnostic)
+
+
+def test_incomplete_diagnosis_is_not_stored():
+    outcome = {'diagnosis_complete': False, 'conflicts': [{'staff_id': 's1', 'issue': '...'}]}
+
+    assert so.cacheable_outcome(outcome)['conflicts'] == []
+    assert so.cacheable_outcome({**outcome, 'diagnosis_complete': True})['conflicts'] == outcome['conflicts']
+
+
+@pytest.mark.parametrize('strict, retry, cacheable', [
+    ('OPTIMAL', None, True),
+    ('FEASIBLE', None, False),
+    ('INFEASIBLE', 'OPTIMAL', True),
+    ('INFEASIBLE', 'FEASIBLE', False),
+    ('INFEASIBLE', None, False),
+])
+def test_is_cacheable_outcome(strict, retry, cacheable):
+    task = {'retry_relaxed': True}
+    outcome = {
+        'success': strict != 'INFEASIBLE',
+        'info': {'status': strict},
+        'retry': None if retry is None else (True, None, {'status': retry}),
+    }
+    assert so.is_cacheable_outcome(task, outcome) is cacheable
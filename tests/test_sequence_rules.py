@@ -0,0 +1,123 @@
+"""
+勤務間ルール（オートマトン）と解なし診断のテスト
+
+オートマトンの受理・拒否が従来の2日間のルール（夜勤→休→休、遅出→翌日早出禁止、
+前月末2日分の引き継ぎ）と一致すること、事前指定と前月末の引き継ぎが両立しない場合に
+diagnose_infeasibility が原因の制約族を特定することを確認する。
+"""
+
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import shift_benchmark as sb  # noqa: E402
+import shift_optimizer as so  # noqa: E402
+
+SHIFT_KEY_BY_INDEX = dict(enumerate(so.SHIFT_KEY_ORDER))
+
+
+def satisfies_pairwise_rules(prev_2nd_last_key, prev_last_key, sequence):
+    """従来のモデルと同じ2日間のルールで判定（前月末2日分 + 当月のシフトインデックス列）"""
+    # 夜勤明け: 前月末の夜勤
+    if prev_last_key == so.SHIFT_KEY_YAKIN and any(t != so.SHIFT_REST for t in sequence[:2]):
+        return False
+    if prev_2nd_last_key == so.SHIFT_KEY_YAKIN and sequence[:1] and sequence[0] != so.SHIFT_REST:
+        return False
+    # インターバル: 前月末の遅出
+    if prev_last_key == so.SHIFT_KEY_OSODE and sequence[:1] and sequence[0] == so.SHIFT_EARLY:
+        return False
+    for d, t in enumerate(sequence):
+        if t == so.SHIFT_NIGHT and any(u != so.SHIFT_REST for u in sequence[d + 1:d + 3]):
+            return False
+        if t == so.SHIFT_LATE and sequence[d + 1:d + 2] == (so.SHIFT_EARLY,):
+            return False
+    return True
+
+
+def accepted_by_automaton(prev_2nd_last_key, prev_last_key, sequence):
+    """build_sequence_automaton の遷移表で列を読み進めて判定（全状態が受理状態）"""
+    initial = so.sequence_state_from_tail(prev_2nd_last_key, prev_last_key)
+    state_ids, transitions = so.build_sequence_automaton([initial])
+    next_state = {(state, t): target for state, t, target in transitions}
+    state = state_ids[initial]
+    for t in sequence:
+        if (state, t) not in next_state:
+            return False
+        state = next_state[state, t]
+    return True
+
+
+@pytest.mark.parametrize('prev_2nd_last_key, prev_last_key', list(itertools.product(so.SHIFT_KEY_ORDER, repeat=2)))
+def test_automaton_matches_pairwise_rules(prev_2nd_last_key, prev_last_key):
+    num_shifts = len(so.SHIFT_KEY_ORDER)
+    for length in range(1, 5):
+        for sequence in itertools.product(range(num_shifts), repeat=length):
+            expected = satisfies_pairwise_rules(prev_2nd_last_key, prev_last_key, sequence)
+            actual = accepted_by_automaton(prev_2nd_last_key, prev_last_key, sequence)
+            assert actual == expected, (prev_2nd_last_key, prev_last_key,
+                                        [SHIFT_KEY_BY_INDEX[t] for t in sequence])
+
+
+def build_diagnosable_group(settings_rows):
+    """1グループ8名の合成データに設定行を足し、解なし診断用のモデルを作る"""
+    holiday_df, staff_df, settings_df = sb.generate_instance(
+        groups=1, staff_per_group=8, tail_ratio=0, assign_density=0
+    )
+    staff_id = staff_df['職員ID'].iloc[0]
+    settings_df = pd.concat([settings_df, pd.DataFrame({
+        '設定ID': [setting_id.format(staff_id=staff_id) for setting_id in settings_rows],
+        '設定値': list(settings_rows.values()),
+    })], ignore_index=True)
+    settings = so.SettingsIndex(settings_df)
+    staff = so.StaffTable.from_dataframe(staff_df)
+    year, month = sb.DEFAULT_INSTANCE['year'], sb.DEFAULT_INSTANCE['month']
+    staff_ids = staff.ids.tolist()
+
+    pre_assignments, _ = so.parse_pre_assignments(settings, staff_ids, year, month, 31)
+    holiday_requests = so.parse_holiday_requests(holiday_df, staff_ids, year, month)
+    group_model = so.build_group_model(
+        1, staff, holiday_requests, settings, year, month, pre_assignments, diagnose=True
+    )
+    return group_model, so.resolve_shift_names(settings), staff_id
+
+
+@pytest.mark.parametrize('settings_rows, expected_families', [
+    # 前月末日の夜勤の明け（1日）に日勤
+    ({'PREV_LAST_SHIFT_{staff_id}': so.SHIFT_KEY_YAKIN, 'ASSIGN_{staff_id}_20251201': so.SHIFT_KEY_NIKKIN},
+     ['事前指定（1日=SHIFT_NIKKIN）', '前月末の引き継ぎ', '勤務間ルール']),
+    # 遅出の翌日に早出
+    ({'ASSIGN_{staff_id}_20251210': so.SHIFT_KEY_OSODE, 'ASSIGN_{staff_id}_20251211': so.SHIFT_KEY_HAYADE},
+     ['事前指定', '10日=SHIFT_OSODE', '11日=SHIFT_HAYADE', '勤務間ルール']),
+])
+def test_diagnose_infeasibility_reports_conflicting_families(settings_rows, expected_families):
+    group_model, names, staff_id = build_diagnosable_group(settings_rows)
+
+    success, _, info = so.solve_group_model(group_model, *names, time_limit=10)
+    assert not success and info['status'] == 'INFEASIBLE'
+
+    issues, complete = so.diagnose_infeasibility(group_model, time_limit=30)
+
+    assert complete
+    assert [issue['staff_id'] for issue in issues] == [staff_id]
+    for family in expected_families:
+        assert family in issues[0]['issue']
+    # 原因の組に関係のない制約族は含めない
+    for family in ('公休数', '連勤制限', '夜勤免除'):
+        assert family not in issues[0]['issue']
+    if '前月末の引き継ぎ' not in expected_families:
+        assert '前月末の引き継ぎ' not in issues[0]['issue']
+
+
+def test_diagnosis_tags_do_not_change_feasible_model():
+    group_model, names, _ = build_diagnosable_group({})
+
+    success, schedule, _ = so.solve_group_model(group_model, *names, time_limit=5)
+
+    assert success
+    assert np.all(schedule.matrix >= 0)
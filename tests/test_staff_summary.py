@@ -0,0 +1,65 @@
+"""
+職員別集計（staff_shift_summary）のテスト
+
+前月末日が夜勤の職員は、月初日の休みを夜勤明けとして公休から除くことを確認する。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import shift_benchmark as sb  # noqa: E402
+import shift_optimizer as so  # noqa: E402
+
+
+def test_first_day_rest_after_previous_month_night_is_not_a_holiday():
+    rest, night, early = so.SHIFT_REST, so.SHIFT_NIGHT, so.SHIFT_EARLY
+    shift_matrix = np.array([
+        [rest, rest, early, night],
+        [rest, rest, early, night],
+    ], dtype=np.int8)
+
+    summary = so.staff_shift_summary(
+        shift_matrix, ['s1', 's2'], [1, 1], [False, False], prev_last_night=[True, False]
+    )
+
+    assert summary['公休'].tolist() == [1, 2]
+    assert summary['夜勤明け'].tolist() == [1, 0]
+    assert summary['休日'].tolist() == [2, 2]
+
+
+def test_summary_matches_strict_holiday_count_with_previous_month_night():
+    holiday_df, staff_df, settings_df = sb.generate_instance(
+        groups=1, staff_per_group=8, tail_ratio=0, assign_density=0
+    )
+    night_staff = staff_df['職員ID'].iloc[0]
+    settings_df = pd.concat([settings_df, pd.DataFrame({
+        '設定ID': [f'PREV_LAST_SHIFT_{night_staff}'],
+        '設定値': [so.SHIFT_KEY_YAKIN],
+    })], ignore_index=True)
+    settings = so.SettingsIndex(settings_df)
+    staff = so.StaffTable.from_dataframe(staff_df)
+    names = so.resolve_shift_names(settings)
+    year, month = sb.DEFAULT_INSTANCE['year'], sb.DEFAULT_INSTANCE['month']
+    staff_ids = staff.ids.tolist()
+
+    holiday_requests = so.parse_holiday_requests(holiday_df, staff_ids, year, month)
+    success, schedule, info = so.optimize_single_group(
+        1, staff, holiday_requests, settings, year, month, *names,
+        np.empty((0, 3), dtype=np.int32), time_limit=5
+    )
+    assert success and not info['relaxed']
+    # 月初日は夜勤明けのため休み
+    assert schedule.matrix[0, 0] == so.SHIFT_REST
+
+    prev_last_night = [settings.prev_tail(staff_id)[1] == so.SHIFT_KEY_YAKIN for staff_id in staff_ids]
+    summary = so.staff_shift_summary(
+        schedule.matrix, staff_ids, staff.groups, staff.care, prev_last_night
+    )
+
+    assert (summary['公休'] == settings.monthly_holidays(year, month)).all()
+    assert summary.loc[0, '夜勤明け'] >= 1